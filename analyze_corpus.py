@@ -0,0 +1,41 @@
+"""
+File: analyze_corpus.py
+
+Analyzes the audio files under the source directories and loads their grains into the database.
+Files that already have grains of a given length are skipped, so this can be rerun as the corpus grows.
+"""
+
+import os
+import platform
+import grain.grain_sql as grain_sql
+from grain.analysis import analyze_corpus
+from grain.source_index import SourceIndex
+
+MAC = "/Users/jmartin50/recording"
+ARGON = "/Users/jmartin50/recording"
+PC = "D:\\recording"
+SYSTEM = platform.system()
+
+if SYSTEM == "Darwin":
+    SOURCE_DIRS = os.path.join(MAC, "samples/granulation_chunks")
+    DB = os.path.join(MAC, "data/grains.sqlite3")
+    CACHE_DIR = os.path.join(MAC, "cache/decoded")
+elif SYSTEM == "Linux":
+    SOURCE_DIRS = [os.path.join(ARGON, "samples/granulation_chunks"), os.path.join("/old_Users/jmartin50/recording", "samples/granulation_chunks")]
+    DB = os.path.join(ARGON, "data/grains.sqlite3")
+    CACHE_DIR = os.path.join(ARGON, "cache/decoded")
+else:
+    SOURCE_DIRS = os.path.join(PC, "samples\\granulation_chunks")
+    DB = os.path.join(PC, "data/grains.sqlite3")
+    CACHE_DIR = os.path.join(PC, "cache\\decoded")
+
+# The grain lengths to analyze, and the distance between grain starts as a fraction of the grain length
+GRAIN_LENGTHS = [2048, 4096, 8192]
+HOP_RATIO = 1.0
+
+if __name__ == "__main__":
+    db, cursor = grain_sql.connect_to_db(DB)
+    source_index = SourceIndex(SOURCE_DIRS, os.path.join(CACHE_DIR, "source_index.json"))
+    analyze_corpus(db, cursor, source_index, GRAIN_LENGTHS, HOP_RATIO)
+    db.close()
+    print("Done.")
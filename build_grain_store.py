@@ -0,0 +1,43 @@
+"""
+File: build_grain_store.py
+
+Builds or updates the grain store that sits alongside the grain database.
+Only grains that are not already in the store are extracted, so this can be rerun as the database grows.
+"""
+
+import os
+import platform
+import grain.grain_sql as grain_sql
+from grain.grain_store import GrainStore, build_grain_store
+from grain.source_index import SourceIndex
+
+MAC = "/Users/jmartin50/recording"
+ARGON = "/Users/jmartin50/recording"
+PC = "D:\\recording"
+SYSTEM = platform.system()
+
+if SYSTEM == "Darwin":
+    SOURCE_DIRS = os.path.join(MAC, "samples/granulation_chunks")
+    DB = os.path.join(MAC, "data/grains.sqlite3")
+    STORE = os.path.join(MAC, "data/grains")
+    CACHE_DIR = os.path.join(MAC, "cache/decoded")
+elif SYSTEM == "Linux":
+    SOURCE_DIRS = [os.path.join(ARGON, "samples/granulation_chunks"), os.path.join("/old_Users/jmartin50/recording", "samples/granulation_chunks")]
+    DB = os.path.join(ARGON, "data/grains.sqlite3")
+    STORE = os.path.join(ARGON, "data/grains")
+    CACHE_DIR = os.path.join(ARGON, "cache/decoded")
+else:
+    SOURCE_DIRS = os.path.join(PC, "samples\\granulation_chunks")
+    DB = os.path.join(PC, "data/grains.sqlite3")
+    STORE = os.path.join(PC, "data/grains")
+    CACHE_DIR = os.path.join(PC, "cache\\decoded")
+
+if __name__ == "__main__":
+    db, cursor = grain_sql.connect_to_db(DB)
+    store = GrainStore(STORE)
+    print(f"The store has {len(store)} grains")
+    source_index = SourceIndex(SOURCE_DIRS, os.path.join(CACHE_DIR, "source_index.json"))
+    build_grain_store(cursor, source_index, store, num_workers=os.cpu_count())
+    print(f"The store now has {len(store)} grains")
+    db.close()
+    print("Done.")
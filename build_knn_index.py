@@ -0,0 +1,33 @@
+"""
+File: build_knn_index.py
+
+Builds the nearest-neighbor index of grain feature vectors. Rerun it after the database changes.
+"""
+
+import os
+import platform
+import grain.grain_sql as grain_sql
+from grain.grain_knn import GrainKNN
+
+MAC = "/Users/jmartin50/recording"
+ARGON = "/Users/jmartin50/recording"
+PC = "D:\\recording"
+SYSTEM = platform.system()
+
+if SYSTEM == "Darwin":
+    DB = os.path.join(MAC, "data/grains.sqlite3")
+    KNN_INDEX = os.path.join(MAC, "data/grains.knn.npz")
+elif SYSTEM == "Linux":
+    DB = os.path.join(ARGON, "data/grains.sqlite3")
+    KNN_INDEX = os.path.join(ARGON, "data/grains.knn.npz")
+else:
+    DB = os.path.join(PC, "data/grains.sqlite3")
+    KNN_INDEX = os.path.join(PC, "data/grains.knn.npz")
+
+if __name__ == "__main__":
+    db, cursor = grain_sql.connect_to_db(DB)
+    knn = GrainKNN.build(cursor)
+    db.close()
+    knn.save(KNN_INDEX)
+    print(f"Indexed {knn.ids.shape[0]} grains in {KNN_INDEX}")
+    print("Done.")
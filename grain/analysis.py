@@ -0,0 +1,360 @@
+"""
+File: analysis.py
+
+Description: Contains the grain analysis pipeline. Each source file is decoded once at the analysis
+sample rate and sliced into grains, and the features in `grain_sql.FIELDS` are computed for a batch of
+grains at a time from rFFTs over the 2-D grain matrix. Files are analyzed in parallel on a process pool,
+and the grain rows are loaded into the database in bulk with `grain_sql.ingest_grains`. Each file and
+grain length is recorded in the analyzed_files table once all of its rows are committed. Recorded files
+are skipped, and the rows of a file whose load was interrupted are replaced, so the analysis can be
+rerun as the corpus grows.
+
+The spectral features follow `aus.analysis` (Eyben, "Real-Time Speech and Music Classification"),
+computed from the unwindowed spectrum of each grain.
+"""
+
+import concurrent.futures
+import numpy as np
+import os
+import scipy.fft
+from . import grain_sql
+from . import grain_tags
+from .decode_cache import decode_audio
+from .source_index import SourceIndex, database_basename
+
+# The audio file extensions to analyze
+AUDIO_EXTENSIONS = [".aif", ".aiff", ".flac", ".mp3", ".ogg", ".wav"]
+
+
+def slice_grains(audio: np.ndarray, length: int, hop: int) -> tuple:
+    """
+    Slices audio into grains
+    :param audio: A 1D array of audio samples
+    :param length: The grain length, in frames
+    :param hop: The distance between grain starts, in frames
+    :return: A tuple (grain start frames, view of the grains with shape (number of grains, length))
+    """
+    if audio.shape[-1] < length:
+        return np.zeros((0), dtype=np.int64), np.zeros((0, length), dtype=audio.dtype)
+    grains = np.lib.stride_tricks.sliding_window_view(audio, length)[::hop]
+    starts = np.arange(grains.shape[0], dtype=np.int64) * hop
+    return starts, grains
+
+
+def estimate_pitch(grains: np.ndarray, sample_rate: int, min_frequency: float = 50.0, max_frequency: float = 2000.0,
+                   threshold: float = 0.6) -> np.ndarray:
+    """
+    Estimates the fundamental frequency of each grain from its autocorrelation, which is computed
+    with zero-padded rFFTs. A grain is pitched if its normalized autocorrelation peak reaches the threshold.
+    At least two periods must fit in a grain, so the lowest detectable frequency also depends on the grain length.
+    :param grains: The grains, with shape (number of grains, length)
+    :param sample_rate: The sample rate
+    :param min_frequency: The lowest frequency to detect
+    :param max_frequency: The highest frequency to detect
+    :param threshold: The minimum normalized autocorrelation peak (0 to 1) for a pitched grain
+    :return: The frequency of each grain, or NaN for unpitched grains
+    """
+    length = grains.shape[-1]
+    frequency = np.full((grains.shape[0]), np.nan)
+    min_lag = max(int(np.floor(sample_rate / max_frequency)), 1)
+    max_lag = min(int(np.ceil(sample_rate / min_frequency)), length // 2)
+    if grains.shape[0] == 0 or max_lag <= min_lag + 1:
+        return frequency
+
+    spectrum = scipy.fft.rfft(grains, n=2 * length, axis=-1)
+    autocorrelation = scipy.fft.irfft(np.square(np.abs(spectrum)), axis=-1)[:, :max_lag + 2]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        autocorrelation = autocorrelation / autocorrelation[:, :1]
+    lag = min_lag + np.argmax(autocorrelation[:, min_lag:max_lag + 1], axis=-1)
+    rows = np.arange(grains.shape[0])
+    peak = autocorrelation[rows, lag]
+
+    # Refine the peak lag with parabolic interpolation
+    before = autocorrelation[rows, lag - 1]
+    after = autocorrelation[rows, lag + 1]
+    curvature = before - 2 * peak + after
+    with np.errstate(divide="ignore", invalid="ignore"):
+        offset = np.where(curvature < 0, 0.5 * (before - after) / curvature, 0.0)
+    pitched = np.isfinite(peak) & (peak >= threshold) & (lag > min_lag) & (lag < max_lag)
+    frequency[pitched] = sample_rate / (lag[pitched] + offset[pitched])
+    return frequency
+
+
+def analyze_grains(grains: np.ndarray, sample_rate: int, min_frequency: float = 50.0, max_frequency: float = 2000.0,
+                   pitch_threshold: float = 0.6) -> dict:
+    """
+    Computes the grain features for a batch of grains
+    :param grains: The grains, with shape (number of grains, length)
+    :param sample_rate: The sample rate
+    :param min_frequency: The lowest frequency for pitch detection
+    :param max_frequency: The highest frequency for pitch detection
+    :param pitch_threshold: The autocorrelation threshold for pitch detection (see `estimate_pitch`)
+    :return: A dictionary of feature name -> array with one value per grain. Frequency and MIDI note are NaN for unpitched grains.
+    """
+    grains = np.asarray(grains, dtype=np.float64)
+    num_bins = grains.shape[-1] // 2 + 1
+    freqs = scipy.fft.rfftfreq(grains.shape[-1], 1 / sample_rate)
+    magnitude_spectrum = np.abs(scipy.fft.rfft(grains, axis=-1))
+    magnitude_spectrum_sum = np.sum(magnitude_spectrum, axis=-1)
+    power_spectrum = np.square(magnitude_spectrum)
+    power_spectrum_sum = np.sum(power_spectrum, axis=-1)
+
+    features = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        spectrum_pmf = power_spectrum / power_spectrum_sum[:, np.newaxis]
+        features["frequency"] = estimate_pitch(grains, sample_rate, min_frequency, max_frequency, pitch_threshold)
+        features["midi"] = np.log2(features["frequency"] / 440) * 12 + 69
+        features["energy"] = np.sqrt(np.mean(np.square(grains), axis=-1))
+        centroid = magnitude_spectrum @ freqs / magnitude_spectrum_sum
+        features["spectral_centroid"] = centroid
+        features["spectral_entropy"] = -np.sum(np.where(spectrum_pmf > 0, spectrum_pmf * np.log2(spectrum_pmf), 0.0), axis=-1)
+        features["spectral_flatness"] = np.exp(np.mean(np.log(magnitude_spectrum), axis=-1)) / (magnitude_spectrum_sum / num_bins)
+        deviation = freqs - centroid[:, np.newaxis]
+        variance = np.sum(np.square(deviation) * spectrum_pmf, axis=-1)
+        features["spectral_variance"] = variance
+        features["spectral_skewness"] = np.sum(np.power(deviation, 3) * spectrum_pmf, axis=-1) / np.float_power(variance, 3 / 2)
+        features["spectral_kurtosis"] = np.sum(np.power(deviation, 4) * spectrum_pmf, axis=-1) / np.square(variance)
+
+        # The roll-off point is the first bin at which the cumulative power reaches the fraction
+        cumulative_power = np.cumsum(spectrum_pmf, axis=-1)
+        for name, fraction in [("50", 0.5), ("75", 0.75), ("90", 0.9), ("95", 0.95)]:
+            reached = cumulative_power >= fraction
+            idx = np.where(np.any(reached, axis=-1), np.argmax(reached, axis=-1), num_bins - 1)
+            features[f"spectral_roll_off_{name}"] = freqs[idx]
+
+        features["spectral_slope"] = _spectral_slope(power_spectrum)
+        features["spectral_slope_0_1_khz"] = _spectral_slope_region(power_spectrum, freqs, 0, 1000, sample_rate)
+        features["spectral_slope_1_5_khz"] = _spectral_slope_region(power_spectrum, freqs, 1000, 5000, sample_rate)
+        features["spectral_slope_0_5_khz"] = _spectral_slope_region(power_spectrum, freqs, 0, 5000, sample_rate)
+
+    # Silent grains produce undefined features, which are stored as 0 (except the pitch, which is NULL)
+    for name, values in features.items():
+        if name not in ("frequency", "midi"):
+            features[name] = np.where(np.isfinite(values), values, 0.0)
+    return features
+
+
+def _spectral_slope(power_spectrum: np.ndarray) -> np.ndarray:
+    """
+    Calculates the spectral slope of each power spectrum (see `aus.analysis.spectral_slope`)
+    :param power_spectrum: The power spectra, with shape (number of grains, number of bins)
+    :return: The slopes
+    """
+    N = power_spectrum.shape[-1]
+    X = np.arange(0, N, 1)
+    sum_x = N * (N - 1) / 2
+    sum_x_2 = N * (N - 1) * (2 * N - 1) / 6
+    return (N * (power_spectrum @ X) - sum_x * np.sum(power_spectrum, axis=-1)) / (N * sum_x_2 - sum_x ** 2)
+
+
+def _spectral_slope_region(power_spectrum: np.ndarray, rfftfreqs: np.ndarray, f_lower: float, f_upper: float, sample_rate: int) -> np.ndarray:
+    """
+    Calculates the spectral slope of each power spectrum between two frequencies, interpolating
+    between bins at the band edges (see `aus.analysis.spectral_slope_region`)
+    :param power_spectrum: The power spectra, with shape (number of grains, number of bins)
+    :param rfftfreqs: The frequencies of the bins
+    :param f_lower: The lower frequency
+    :param f_upper: The upper frequency
+    :param sample_rate: The sample rate
+    :return: The slopes
+    """
+    N = power_spectrum.shape[-1]
+    f_0 = sample_rate / ((N - 1) * 2)
+    m_fl = f_lower / f_0
+    m_fu = min(f_upper / f_0, N - 1)
+    m_fl_ceil = int(np.ceil(m_fl))
+    m_fl_floor = int(np.floor(m_fl))
+    m_fu_ceil = int(np.ceil(m_fu))
+    m_fu_floor = int(np.floor(m_fu))
+
+    lower = power_spectrum[:, m_fl_floor] + (m_fl - m_fl_floor) * (power_spectrum[:, m_fl_ceil] - power_spectrum[:, m_fl_floor])
+    upper = power_spectrum[:, m_fu_floor] + (m_fu - m_fu_floor) * (power_spectrum[:, m_fu_ceil] - power_spectrum[:, m_fu_floor])
+    inner = power_spectrum[:, m_fl_ceil:m_fu_floor]
+    inner_freqs = rfftfreqs[m_fl_ceil:m_fu_floor]
+    sum_x = f_lower + np.sum(inner_freqs) + f_upper
+    sum_y = lower + np.sum(inner, axis=-1) + upper
+    sum_x_2 = f_lower ** 2 + np.sum(np.square(inner_freqs)) + f_upper ** 2
+    sum_xy = f_lower * lower + inner @ inner_freqs + f_upper * upper
+    return (N * sum_xy - sum_x * sum_y) / (N * sum_x_2 - sum_x ** 2)
+
+
+def analyze_file(path: str, lengths: list, hop_ratio: float = 1.0, sample_rate: int = 44100, batch_size: int = 256,
+                 min_frequency: float = 50.0, max_frequency: float = 2000.0, pitch_threshold: float = 0.6) -> list:
+    """
+    Analyzes the grains of one source file. The first channel is analyzed, at the analysis sample rate,
+    which is also the rate that grains are read at when rendering.
+    :param path: The path of the audio file
+    :param lengths: The grain lengths to analyze, in frames
+    :param hop_ratio: The distance between grain starts, as a fraction of the grain length
+    :param sample_rate: The analysis sample rate
+    :param batch_size: The number of grains to analyze at a time
+    :param min_frequency: The lowest frequency for pitch detection
+    :param max_frequency: The highest frequency for pitch detection
+    :param pitch_threshold: The autocorrelation threshold for pitch detection
+    :return: A list of grain records in `grain_sql.INGEST_FIELDS` order
+    """
+    audio = decode_audio(path, sample_rate)[0]
+    records = []
+    for length in lengths:
+        starts, grains = slice_grains(audio, length, max(int(length * hop_ratio), 1))
+        for i in range(0, starts.shape[0], batch_size):
+            columns = analyze_grains(grains[i:i+batch_size], sample_rate, min_frequency, max_frequency, pitch_threshold)
+            batch_starts = starts[i:i+batch_size]
+            columns["file"] = [path for _ in range(batch_starts.shape[0])]
+            columns["start_frame"] = batch_starts
+            columns["end_frame"] = batch_starts + length
+            columns["length"] = np.full(batch_starts.shape, length)
+            columns["sample_rate"] = np.full(batch_starts.shape, sample_rate)
+            columns["grain_duration"] = np.full(batch_starts.shape, length / sample_rate)
+            # Unpitched grains have NULL frequency and MIDI note
+            columns = [[None if value != value else value for value in np.asarray(columns[field]).tolist()] for field in grain_sql.INGEST_FIELDS]
+            records += list(zip(*columns))
+    return records
+
+
+def find_audio_files(source_dir) -> list:
+    """
+    Finds the audio files under the source directories
+    :param source_dir: The source directory, list of directories, or SourceIndex
+    :return: A sorted list of audio file paths
+    """
+    if not isinstance(source_dir, SourceIndex):
+        source_dir = SourceIndex(source_dir)
+    paths = []
+    for file, file_paths in source_dir.files.items():
+        if os.path.splitext(file)[1].lower() in AUDIO_EXTENSIONS:
+            paths += file_paths
+    return sorted(paths)
+
+
+def prepare_analysis_tables(db, cursor):
+    """
+    Creates the files, grains and analyzed_files tables if they do not exist. When the analyzed_files
+    table is created, the files and lengths that already have grains are recorded as analyzed.
+    :param db: A connection to a SQLite database
+    :param cursor: The cursor for executing SQL
+    """
+    grain_sql.create_files_table(cursor)
+    grain_sql.create_grains_table(cursor)
+    cursor.execute("PRAGMA table_info(grains);")
+    if "file_id" not in [row[1] for row in cursor.fetchall()]:
+        raise ValueError("The grains table has no file_id column. Run migrate_files_table.py first.")
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'analyzed_files';")
+    is_new = cursor.fetchone() is None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS analyzed_files (
+            file_id INTEGER NOT NULL REFERENCES files(id),
+            length INTEGER NOT NULL,
+            PRIMARY KEY (file_id, length)
+        );
+    """)
+    if is_new:
+        cursor.execute("INSERT OR IGNORE INTO analyzed_files (file_id, length) SELECT DISTINCT file_id, length FROM grains;")
+    db.commit()
+
+
+def analyze_corpus(db, cursor, source_dir, lengths: list, hop_ratio: float = 1.0, sample_rate: int = 44100,
+                   max_workers: int = None, batch_size: int = 10000, **kwargs) -> dict:
+    """
+    Analyzes the audio files under the source directories and loads the grains into the database.
+    Files are matched to the database by file name, as in `grain_sql.find_path`; a file is skipped
+    for each grain length that it has been analyzed at. Grains from an interrupted load of a file
+    are deleted and the file is analyzed again.
+    :param db: A connection to a SQLite database
+    :param cursor: The cursor for executing SQL
+    :param source_dir: The source directory, list of directories, or SourceIndex
+    :param lengths: The grain lengths to analyze, in frames
+    :param hop_ratio: The distance between grain starts, as a fraction of the grain length
+    :param sample_rate: The analysis sample rate
+    :param max_workers: The number of worker processes. Defaults to the number of cores.
+    :param batch_size: The number of grain rows to insert per transaction
+    :param kwargs: Pitch detection options for `analyze_file`
+    :return: The load statistics from `grain_sql.ingest_grains`
+    """
+    if not isinstance(source_dir, SourceIndex):
+        source_dir = SourceIndex(source_dir)
+    prepare_analysis_tables(db, cursor)
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tags';")
+    has_tags = cursor.fetchone() is not None
+
+    done = {}
+    for length in lengths:
+        # Remove the grains of interrupted loads
+        cursor.execute("SELECT DISTINCT file_id FROM grains WHERE length = ? AND file_id NOT IN (SELECT file_id FROM analyzed_files WHERE length = ?);", (length, length))
+        for (file_id,) in cursor.fetchall():
+            # The reloaded grains can reuse the deleted ids, so they must be tagged again
+            cursor.execute("SELECT MIN(id) FROM grains WHERE file_id = ? AND length = ?;", (file_id, length))
+            grain_tags.rewind_tag_state(cursor, cursor.fetchone()[0])
+            if has_tags:
+                cursor.execute("DELETE FROM tags WHERE grain_id IN (SELECT id FROM grains WHERE file_id = ? AND length = ?);", (file_id, length))
+            cursor.execute("DELETE FROM grains WHERE file_id = ? AND length = ?;", (file_id, length))
+            print(f"Removed {cursor.rowcount} grains of length {length} from an interrupted load of file {file_id}")
+        db.commit()
+
+        # Find the lengths that each file still needs
+        cursor.execute("SELECT path FROM files WHERE id IN (SELECT file_id FROM analyzed_files WHERE length = ?);", (length,))
+        done[length] = set(database_basename(path) for (path,) in cursor.fetchall())
+    jobs = []
+    for path in find_audio_files(source_dir):
+        file_lengths = [length for length in lengths if database_basename(path) not in done[length]]
+        if len(file_lengths) > 0:
+            jobs.append((path, file_lengths))
+    print(f"Analyzing {len(jobs)} files")
+    if len(jobs) == 0:
+        return {"rows": 0, "seconds": 0.0, "rows_per_second": 0.0}
+
+    # A file is recorded as analyzed once the batch that holds its last row is committed
+    finished = []
+
+    def record_finished(num_rows: int):
+        while len(finished) > 0 and finished[0][0] <= num_rows:
+            _, path, file_lengths = finished.pop(0)
+            file_id = grain_sql.get_file_ids(cursor, [path])[path]
+            cursor.executemany("INSERT OR IGNORE INTO analyzed_files (file_id, length) VALUES (?, ?);", [(file_id, length) for length in file_lengths])
+        db.commit()
+
+    records = _analyze_files(jobs, hop_ratio, sample_rate, max_workers, kwargs, finished)
+    stats = grain_sql.ingest_grains(db, cursor, records, batch_size, on_commit=record_finished)
+    record_finished(stats["rows"])
+    grain_sql.update_file_info(db, cursor, source_dir)
+    return stats
+
+
+def _analyze_files(jobs: list, hop_ratio: float, sample_rate: int, max_workers: int, kwargs: dict, finished: list):
+    """
+    Analyzes files on a process pool and yields the grain records as the files finish.
+    At most two files per worker are in flight, so finished records do not pile up in memory
+    while the database is busy.
+    :param jobs: A list of tuples (path, grain lengths)
+    :param hop_ratio: The distance between grain starts, as a fraction of the grain length
+    :param sample_rate: The analysis sample rate
+    :param max_workers: The number of worker processes
+    :param kwargs: Pitch detection options for `analyze_file`
+    :param finished: A list that receives a tuple (number of records yielded so far, path, grain lengths)
+    after the last record of each file is yielded
+    :return: A generator of grain records
+    """
+    num_records = 0
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = list(reversed(jobs))
+        inflight = {}
+        inflight_lengths = {}
+        while len(pending) > 0 or len(inflight) > 0:
+            while len(pending) > 0 and len(inflight) < 2 * max_workers:
+                path, lengths = pending.pop()
+                inflight[executor.submit(analyze_file, path, lengths, hop_ratio, sample_rate, **kwargs)] = path
+                inflight_lengths[path] = lengths
+            done, _ = concurrent.futures.wait(inflight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                path = inflight.pop(future)
+                file_lengths = inflight_lengths.pop(path)
+                try:
+                    records = future.result()
+                except Exception as e:
+                    print(f"Could not analyze {path}: {e!r}")
+                    continue
+                yield from records
+                num_records += len(records)
+                finished.append((num_records, path, file_lengths))
@@ -0,0 +1,170 @@
+"""
+File: decode_cache.py
+
+Description: Contains source audio decoding tools. Grains can be decoded span by span, reading only
+the frames they need, or whole files can be decoded into a persistent on-disk cache. The cache stores
+decoded, resampled float32 .npy files and loads them through memory maps, so later renders and
+sibling processes share the same pages instead of decoding the files again.
+"""
+
+import hashlib
+import numpy as np
+import os
+import pedalboard as pb
+import threading
+
+
+def decode_audio(path: str, sample_rate: int = 44100) -> np.ndarray:
+    """
+    Decodes an audio file and resamples it
+    :param path: The path of the audio file
+    :param sample_rate: The sample rate to resample to
+    :return: The audio as a float32 array with shape (channels, frames)
+    """
+    with pb.io.AudioFile(path).resampled_to(sample_rate) as f:
+        audio = f.read(f.frames)
+    if audio.ndim == 1:
+        audio = np.reshape(audio, (1, audio.shape[0]))
+    return audio.astype(np.float32, copy=False)
+
+
+def merge_spans(starts: np.ndarray, ends: np.ndarray, max_gap: int = 0) -> list:
+    """
+    Merges frame ranges that overlap or are adjacent, so each merged range can be read at once
+    :param starts: The start frame of each range
+    :param ends: The end frame of each range
+    :param max_gap: Ranges separated by at most this many frames are also merged
+    :return: A list of tuples (start, end, member indices), in frame order
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if starts.shape[-1] == 0:
+        return []
+    order = np.argsort(starts, kind="stable")
+    sorted_ends = np.maximum.accumulate(ends[order])
+    # a new range begins wherever a start lies past the furthest end seen so far
+    breaks = np.flatnonzero(starts[order][1:] > sorted_ends[:-1] + max_gap) + 1
+    spans = []
+    for members in np.split(order, breaks):
+        spans.append((int(starts[members[0]]), int(np.max(ends[members])), members))
+    return spans
+
+
+def read_spans(path: str, spans: list, sample_rate: int = 44100) -> list:
+    """
+    Decodes only the given frame ranges of an audio file. Frames are counted at the target
+    sample rate; if the file has a different native rate, it is resampled while reading,
+    and seeking in the resampled stream keeps the frames aligned with a whole-file read.
+    :param path: The path of the audio file
+    :param spans: A list of tuples (start frame, end frame), as returned by `merge_spans`
+    :param sample_rate: The sample rate to resample to
+    :return: A list of float32 arrays with shape (channels, frames), one per span
+    """
+    blocks = []
+    with pb.io.AudioFile(path) as f:
+        reader = f.resampled_to(sample_rate) if f.samplerate != sample_rate else f
+        for span in spans:
+            reader.seek(min(span[0], reader.frames))
+            audio = reader.read(max(span[1] - span[0], 0))
+            if audio.ndim == 1:
+                audio = np.reshape(audio, (1, audio.shape[0]))
+            blocks.append(audio.astype(np.float32, copy=False))
+    return blocks
+
+
+class DecodeCache:
+    """
+    A size-capped cache of decoded, resampled source audio, keyed by path, modification time and sample rate.
+    The least recently used entries are evicted when the cache grows past its size cap.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int = 8 * 1024 ** 3, sample_rate: int = 44100):
+        """
+        Initializes the cache
+        :param cache_dir: The directory to store decoded audio in. It is created if it does not exist.
+        :param max_bytes: The maximum total size of the cache, in bytes
+        :param sample_rate: The sample rate to resample to
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.sample_rate = sample_rate
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def __call__(self, path: str) -> np.ndarray:
+        """
+        Gets the decoded audio for a file, decoding it if it is not in the cache.
+        Sibling processes can evict an entry at any time, so an entry that disappears is treated as a miss.
+        :param path: The path of the audio file
+        :return: A read-only float32 array with shape (channels, frames), memory-mapped unless the
+        new entry was evicted by another process before it could be mapped
+        """
+        cache_path = self.cache_path(path)
+        try:
+            # touch the entry so that eviction is least-recently-used
+            os.utime(cache_path)
+            audio = np.load(cache_path, mmap_mode="r")
+            self.hits += 1
+            return audio
+        except FileNotFoundError:
+            pass
+
+        self.misses += 1
+        audio = decode_audio(path, self.sample_rate)
+        temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            np.save(f, audio)
+        os.replace(temp_path, cache_path)
+        self.evict(keep=cache_path)
+        try:
+            return np.load(cache_path, mmap_mode="r")
+        except FileNotFoundError:
+            # another process evicted the new entry already, so the decoded audio is returned directly
+            audio.setflags(write=False)
+            return audio
+
+    def cache_path(self, path: str) -> str:
+        """
+        Gets the cache file path for an audio file
+        :param path: The path of the audio file
+        :return: The cache file path
+        """
+        path = os.path.abspath(path)
+        key = f"{path}|{os.stat(path).st_mtime_ns}|{self.sample_rate}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npy")
+
+    def entries(self) -> list:
+        """
+        Lists the cache entries, least recently used first
+        :return: A list of tuples (cache file path, size in bytes, last access time)
+        """
+        entries = []
+        for file in os.listdir(self.cache_dir):
+            if file.endswith(".npy"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, file))
+                except FileNotFoundError:
+                    # another process removed the entry after it was listed
+                    continue
+                entries.append((os.path.join(self.cache_dir, file), stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda x: x[2])
+        return entries
+
+    def evict(self, keep: str = None):
+        """
+        Removes the least recently used entries until the cache fits in its size cap
+        :param keep: A cache file path that should not be removed
+        """
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                # the file may still be mapped by another process
+                pass
@@ -1,7 +1,10 @@
 """
 File: effects.py
 
-This file contains audio effect definitions
+This file contains audio effect definitions. The effects return audio in the dtype they are given
+(the pedalboard effects always return float32).
+Effects with `batched = True` treat each row of a 2D array as a separate signal, so they can be
+applied to a stack of grains at once. The other effects are applied one grain at a time.
 """
 
 import numpy as np
@@ -14,6 +17,8 @@ class AMEffect:
     """
     A constant AM effect
     """
+    batched = True
+
     def __init__(self, freqs: list, muls: list, adds: list, sample_rate: int = 44100):
         """
         Initializes the AM effect. The freqs, muls, and adds have to have the same len.
@@ -33,7 +38,7 @@ class AMEffect:
         :param audio: The audio to apply the AM effect to
         :return: The modulated audio
         """
-        mod_arr = np.zeros((audio.shape[-1]))
+        mod_arr = np.zeros((audio.shape[-1]), dtype=audio.dtype)
         for i in range(len(self.freqs)):
             mod_arr += synthesis.sine(self.freqs[i], 0, audio.shape[-1], self.sample_rate)
         if audio.ndim > 1:
@@ -46,6 +51,8 @@ class ButterworthFilterEffect:
     """
     A Butterworth filter effect
     """
+    batched = True
+
     def __init__(self, freq: float, filter_type: str = "lowpass", order: int = 1, sample_rate: int = 44100):
         """
         Initializes the ButterworthFilterEffect.
@@ -66,7 +73,8 @@ class ButterworthFilterEffect:
         :param audio: The audio to apply the effect to
         :return: The new audio
         """
-        return scipy.signal.sosfilt(self.filter, audio)
+        # The filter runs in float64, since IIR filters with low cutoffs lose precision in float32
+        return scipy.signal.sosfilt(self.filter, audio).astype(audio.dtype, copy=False)
 
 
 class IdentityEffect:
@@ -1,18 +1,83 @@
 """
 File: grain_assembler.py
 
-Description: Contains grain assembler tools. Workflow consists of
+Description: Contains grain assembler tools. Each tool accepts either a list of grain dictionaries
+or a GrainTable; the table versions operate on whole columns. Workflow consists of
     1.a.) running an "assemble" function
     1.b.) performing any modifications to the assembled grains, such as interpolating a transition to another grain list
     2.a.) calculating the final grain positions using `calculate_grain_positions`
-    2.b.) performing any post-calculation modifications, like changing the channel index of some grains
-    3.) merging the grains to create an audio array using `merge`
+    2.b.) performing any post-calculation modifications, like changing the channel index of some grains,
+          or applying per-grain effects with `apply_effects` once the grain audio is loaded
+    3.) merging the grains to create an audio array using `merge` (or `pack_grains` and `merge_packed`
+        for a batched merge of equal-length grains, or `merge_blocks` for a streaming merge)
+Grain dictionaries may be LazyGrain records (see `grain_sql.read_grains_from_file` with lazy=True), so that
+grains removed during assembly are never loaded. The merge functions load the remaining grains' audio
+in one batch per source file before merging.
 """
 
 import aus.operations as operations
 import numpy as np
 import random
 from . import grain_tools
+from .effects import IdentityEffect
+from .grain_sql import prefetch_grains
+from .grain_table import GrainTable
+from .windows import get_window, sine_fade, cosine_fade
+
+
+def _find_segment(x_points: list, x) -> int:
+    """
+    Finds the envelope segment that contains x, using a binary search
+    :param x_points: The envelope X points
+    :param x: The x value. It must lie strictly inside the envelope.
+    :return: The segment index
+    """
+    idx = -1
+    low = 0
+    high = len(x_points)
+    while low <= high and idx == -1:
+        mid = low + (high - low) // 2
+        if x_points[mid] <= x <= x_points[mid+1]:
+            idx = mid
+        elif x_points[mid] < x:
+            low = mid + 1
+        else:
+            high = mid - 1
+    return idx
+
+
+def _segment_indices(x_points: list, x: np.ndarray) -> np.ndarray:
+    """
+    Finds the envelope segment for each value in an array of x values.
+    An x value that falls exactly on an interior X point belongs to two segments; it is given
+    the segment that the scalar binary search picks, so array and scalar calls agree.
+    :param x_points: The envelope X points
+    :param x: An array of x values
+    :return: An array of segment indices, clipped to valid segments
+    """
+    x_arr = np.asarray(x_points)
+    idx = np.clip(np.searchsorted(x_arr, x, side="right") - 1, 0, len(x_points) - 2)
+    on_knot = (x == x_arr[idx]) & (idx > 0)
+    if np.any(on_knot):
+        knot_segments = np.array([0] + [_find_segment(x_points, x_points[k]) for k in range(1, len(x_points) - 1)] + [0])
+        idx[on_knot] = knot_segments[idx[on_knot]]
+    return idx
+
+
+def _clamp_envelope(y_points: list, x_points: list, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Holds the first and last Y points outside the envelope's X range.
+    The result is an integer array if all Y points are integers.
+    :param y_points: The envelope Y points
+    :param x_points: The envelope X points
+    :param x: An array of x values
+    :param y: The interpolated y values
+    :return: The envelope output
+    """
+    y = np.where(x <= x_points[0], y_points[0], np.where(x >= x_points[-1], y_points[-1], y))
+    if all(isinstance(point, (int, np.integer)) for point in y_points):
+        y = y.astype(np.int64)
+    return y
 
 
 class LinearEnvelope:
@@ -35,25 +100,20 @@ class LinearEnvelope:
     def __call__(self, x):
         """
         Returns the linearly interpolated output value for a given x input
-        :param x: The x value
-        :return: The y value
+        :param x: The x value, or an array of x values
+        :return: The y value, or an array of y values
         """
-        if x <= self.x_points[0]:
+        if np.ndim(x) > 0:
+            x = np.asarray(x)
+            idx = _segment_indices(self.x_points, x)
+            y = np.rint(np.asarray(self.slopes)[idx] * (x - np.asarray(self.x_points)[idx]) + np.asarray(self.y_points)[idx])
+            return _clamp_envelope(self.y_points, self.x_points, x, y)
+        elif x <= self.x_points[0]:
             return self.y_points[0]
         elif x >= self.x_points[-1]:
             return self.y_points[-1]
         else:
-            idx = -1
-            low = 0
-            high = len(self.x_points)
-            while low <= high and idx == -1:
-                mid = low + (high - low) // 2
-                if self.x_points[mid] <= x <= self.x_points[mid+1]:
-                    idx = mid
-                elif self.x_points[mid] < x:
-                    low = mid + 1
-                else:
-                    high = mid - 1
+            idx = _find_segment(self.x_points, x)
             return round(self.slopes[idx] * (x - self.x_points[idx]) + self.y_points[idx])
 
 
@@ -95,36 +155,38 @@ class NthPowerEnvelope:
     def __call__(self, x):
         """
         Returns the interpolated output value for a given x input
-        :param x: The x value
-        :return: The y value
+        :param x: The x value, or an array of x values
+        :return: The y value, or an array of y values
         """
-        if x <= self.x_points[0]:
+        if np.ndim(x) > 0:
+            x = np.asarray(x)
+            idx = _segment_indices(self.x_points, x)
+            base = x - np.asarray(self.x_points)[idx] - np.asarray(self.a)[idx]
+            y = np.rint(np.asarray(self.gain)[idx] * base ** np.asarray(self.powers)[idx] + np.asarray(self.y_points)[idx])
+            return _clamp_envelope(self.y_points, self.x_points, x, y)
+        elif x <= self.x_points[0]:
             return self.y_points[0]
         elif x >= self.x_points[-1]:
             return self.y_points[-1]
         else:
-            idx = -1
-            low = 0
-            high = len(self.x_points)
-            while low <= high and idx == -1:
-                mid = low + (high - low) // 2
-                if self.x_points[mid] <= x <= self.x_points[mid+1]:
-                    idx = mid
-                elif self.x_points[mid] < x:
-                    low = mid + 1
-                else:
-                    high = mid - 1
+            idx = _find_segment(self.x_points, x)
             return round(self.gain[idx] * (x - self.x_points[idx] - self.a[idx]) ** self.powers[idx] + self.y_points[idx])
 
 
 def assemble_repeat(grain, n: int, distance_between_grains: int) -> list:
     """
     Repeats a grain or list of grains for n times.
-    :param grain: A grain dictionary or list of grains
+    :param grain: A grain dictionary, list of grains or GrainTable
     :param n: The number of times to repeat
     :param distance_between_grains: The distance between each grain, in frames. If negative, grains will overlap. If positive, there will be a gap between grains.
-    :return: A list of grain tuples, specifying where each grain should go
+    :return: A list of grain tuples, specifying where each grain should go (a GrainTable if `grain` is a GrainTable)
     """
+    if isinstance(grain, GrainTable):
+        grains = grain.take(np.tile(np.arange(len(grain)), n))
+        grains["distance_between_grains"] = distance_between_grains
+        grains["channel"] = 0
+        return grains
+
     grains = []
 
     # deep copy is necessary
@@ -148,12 +210,20 @@ def assemble_single(grains: list, features: list, distance_between_grains: int)
     Assembles grains. Each grain is only used once. 
     Grains are sorted by features provided in the `features` list: first by feature 0, then by feature 1, etc.
     For this to work properly, you may want to round the features you are using.
-    You can optionally provide an effect chain to apply to each grain, and an effect cycle where each effect is applied to the nth grain, mod the length of the effect cycle.
-    :param grains: A list of grain dictionaries to choose from
+    To apply an effect chain to each grain, and an effect cycle where each effect is applied to the nth grain,
+    mod the length of the effect cycle, use `apply_effects` once the grain audio is loaded.
+    :param grains: A list of grain dictionaries (or a GrainTable) to choose from
     :param feature: The string name of the audio feature to use
     :param distance_between_grains: The distance between each grain, in frames. If negative, grains will overlap. If positive, there will be a gap between grains.
     :return: The assembled grains as an array
     """
+    if isinstance(grains, GrainTable):
+        # Successive stable sorts are equivalent to a lexsort with the last feature as the primary key
+        grains = grains.take(np.lexsort([grains[feature] for feature in features])) if len(features) > 0 else grains.copy()
+        grains["distance_between_grains"] = distance_between_grains
+        grains["channel"] = 0
+        return grains
+
     # Organize the grains
     for feature in features:
         grains = sorted(grains, key=lambda x: x[feature])
@@ -168,12 +238,22 @@ def assemble_single(grains: list, features: list, distance_between_grains: int)
 def assemble_stochastic(grains: list, n: int, distance_between_grains: int, rng: random.Random) -> np.ndarray:
     """
     Assembles grains stochastically. Each grain is used n times.
-    :param grains: A list of grain dictionaries to choose from
+    :param grains: A list of grain dictionaries (or a GrainTable) to choose from
     :param n: The number of occurrences of each grain
     :param rng: A random number generator object
     :param distance_between_grains: The distance between each grain, in frames. If negative, grains will overlap. If positive, there will be a gap between grains.
     :return: The assembled grains as an array
     """
+    if isinstance(grains, GrainTable):
+        # Shuffle indices with the same calls as the list version, so a seeded rng gives the same order
+        indices = list(range(len(grains))) * n
+        for i in range(n):
+            rng.shuffle(indices)
+        grains = grains.take(indices)
+        grains["distance_between_grains"] = distance_between_grains
+        grains["channel"] = 0
+        return grains
+
     grains = grains * n
     for i in range(n):
         rng.shuffle(grains)
@@ -185,31 +265,165 @@ def assemble_stochastic(grains: list, n: int, distance_between_grains: int, rng:
     return grains
 
 
-def calculate_grain_positions(grains: list):
+def apply_effects(grains: list, effect_chain: list = None, effect_cycle: list = None):
+    """
+    Applies effects to the grain audio. Every effect in the effect chain is applied to every grain,
+    and then effect i of the effect cycle is applied to every grain whose index is i mod the length
+    of the cycle. The grains are stacked into one 2D array per grain length, and each effect runs once
+    per stack (or per part of a stack, for cycle effects). IdentityEffects are skipped.
+    The grain audio must be loaded. For a GrainTable, the processed audio goes into a new sample buffer
+    with one slot per record, since repeated records can receive different cycle effects.
+    :param grains: A list of grain dictionaries or a GrainTable
+    :param effect_chain: A list of effects to apply to every grain
+    :param effect_cycle: A list of effects to apply in rotation
+    """
+    effect_chain = [effect for effect in (effect_chain if effect_chain is not None else []) if not isinstance(effect, IdentityEffect)]
+    effect_cycle = effect_cycle if effect_cycle is not None else []
+    cycle_idx = np.arange(len(grains)) % len(effect_cycle) if len(effect_cycle) > 0 else np.zeros((len(grains)), dtype=np.int64)
+    active = [i for i, effect in enumerate(effect_cycle) if not isinstance(effect, IdentityEffect)]
+    if len(grains) == 0 or (len(effect_chain) == 0 and len(active) == 0):
+        return
+
+    is_table = isinstance(grains, GrainTable)
+    if is_table:
+        if np.any(grains["sample_offset"] < 0):
+            raise ValueError("The grain audio must be loaded before applying effects.")
+        lengths = grains.lengths
+        offsets = np.cumsum(lengths) - lengths
+        samples = np.empty((int(np.sum(lengths))), dtype=grains.samples.dtype)
+    else:
+        prefetch_grains(grains)
+        lengths = np.fromiter((grain["grain"].shape[-1] for grain in grains), dtype=np.int64, count=len(grains))
+
+    for grain_length in np.unique(lengths):
+        rows = np.flatnonzero(lengths == grain_length)
+        if is_table:
+            batch = grains.samples[grains["sample_offset"][rows, np.newaxis] + np.arange(grain_length)]
+        else:
+            batch = np.stack([grains[i]["grain"] for i in rows])
+        for effect in effect_chain:
+            batch = _apply_effect(effect, batch)
+        for i in active:
+            selected = cycle_idx[rows] == i
+            if np.any(selected):
+                batch[selected] = _apply_effect(effect_cycle[i], batch[selected])
+        if is_table:
+            samples[offsets[rows, np.newaxis] + np.arange(grain_length)] = batch
+        else:
+            for j, i in enumerate(rows):
+                grains[i]["grain"] = batch[j]
+
+    if is_table:
+        grains["sample_offset"] = offsets
+        grains.samples = samples
+
+
+def adjust_grain_levels(grains: list, max_level: float):
+    """
+    Adjusts the level of each grain with `aus.operations.adjust_level`. The grain audio must be loaded.
+    The grain audio is not changed in place, since records can share audio arrays and a GrainTable's
+    sample buffer can be shared with other tables. A GrainTable gets a new sample buffer with one slot
+    per distinct grain.
+    :param grains: A list of grain dictionaries or a GrainTable
+    :param max_level: The max level for each grain, in dBFS
+    """
+    if len(grains) == 0:
+        return
+
+    if isinstance(grains, GrainTable):
+        if np.any(grains["sample_offset"] < 0):
+            raise ValueError("The grain audio must be loaded before adjusting the grain levels.")
+        source_offsets, first, inverse = np.unique(grains["sample_offset"], return_index=True, return_inverse=True)
+        lengths = grains.lengths[first]
+        offsets = np.cumsum(lengths) - lengths
+        samples = np.empty((int(np.sum(lengths))), dtype=grains.samples.dtype)
+        for source_offset, offset, length in zip(source_offsets.tolist(), offsets.tolist(), lengths.tolist()):
+            samples[offset:offset + length] = operations.adjust_level(grains.samples[source_offset:source_offset + length], max_level)
+        grains["sample_offset"] = offsets[np.reshape(inverse, (-1))]
+        grains.samples = samples
+        return
+
+    prefetch_grains(grains)
+    adjusted = set()
+    for grain in grains:
+        if id(grain) not in adjusted:
+            adjusted.add(id(grain))
+            grain["grain"] = operations.adjust_level(grain["grain"], max_level)
+
+
+def _apply_effect(effect, batch: np.ndarray) -> np.ndarray:
+    """
+    Applies an effect to a stack of equal-length grains
+    :param effect: The effect
+    :param batch: A 2D array with one grain per row
+    :return: The processed stack
+    """
+    if getattr(effect, "batched", False):
+        return np.asarray(effect(batch))
+    return np.stack([np.reshape(effect(row), row.shape) for row in batch])
+
+
+def calculate_grain_positions(grains: list, distances=None):
     """
     Calculates the actual onset position for each grain in a list of grains.
     Each grain should be a dictionary with keys (grain, distance_between_grains),
     and this function will add keys (start_idx, end_idx) to each grain.
     After this function is run, you can use the `merge_grains` function to merge
     the grains into an audio array.
-    :param grains: A list of grain dictionaries
+    :param grains: A list of grain dictionaries or a GrainTable
+    :param distances: An optional array of distances between grains, one per grain (for example,
+    an envelope evaluated over the grain indices). If provided, it replaces distance_between_grains.
+    """
+    if distances is not None:
+        distances = np.rint(np.asarray(distances)).astype(np.int64)
+
+    if isinstance(grains, GrainTable):
+        if distances is not None:
+            grains["distance_between_grains"] = distances
+        start_idx, end_idx = grain_positions(grains.lengths, grains["distance_between_grains"])
+        grains["start_idx"] = start_idx
+        grains["end_idx"] = end_idx
+        return
+
+    if distances is not None:
+        for grain, distance in zip(grains, distances.tolist()):
+            grain["distance_between_grains"] = distance
+    else:
+        distances = np.fromiter((grain["distance_between_grains"] for grain in grains), dtype=np.int64, count=len(grains))
+    lengths = np.fromiter((grain["end_frame"] - grain["start_frame"] for grain in grains), dtype=np.int64, count=len(grains))
+    start_idx, end_idx = grain_positions(lengths, distances)
+    for grain, start, end in zip(grains, start_idx.tolist(), end_idx.tolist()):
+        grain["start_idx"] = start
+        grain["end_idx"] = end
+
+
+def grain_positions(lengths: np.ndarray, distances: np.ndarray) -> tuple:
     """
-    end_idx = grains[0]["end_frame"] - grains[0]["start_frame"]
-    grains[0]["start_idx"] = 0
-    grains[0]["end_idx"] = end_idx
-    for i in range(1, len(grains)):
-        start_idx = end_idx + grains[i]["distance_between_grains"]
-        end_idx = start_idx + grains[i]["end_frame"] - grains[i]["start_frame"]
-        grains[i]["start_idx"] = start_idx
-        grains[i]["end_idx"] = end_idx
+    Calculates grain onsets as a prefix sum. Each grain starts at the previous grain's end
+    plus its own distance, so start[i] = sum(lengths[:i]) + sum(distances[1:i+1]).
+    The first grain's distance is ignored, and the first grain starts at 0.
+    :param lengths: The grain lengths, in frames
+    :param distances: The distance before each grain, in frames
+    :return: A tuple of arrays (start_idx, end_idx)
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    steps = np.zeros((lengths.shape[-1]), dtype=np.int64)
+    steps[1:] = lengths[:-1] + np.asarray(distances, dtype=np.int64)[1:]
+    start_idx = np.cumsum(steps)
+    return start_idx, start_idx + lengths
 
 
 def delete_nth_grains(grains: list, n: int):
     """
     Deletes every nth grain.
-    :param grains: A list of grains
+    :param grains: A list of grains or a GrainTable
     :param n: Every nth grain will be deleted
     """
+    if isinstance(grains, GrainTable):
+        # the list version removes the grains originally at n, 2n, 3n, ...
+        del grains[np.arange(n, len(grains), n)]
+        return
+
     i = n
     while i < len(grains):
         del grains[i]
@@ -219,10 +433,14 @@ def delete_nth_grains(grains: list, n: int):
 def interleave(list1: list, list2: list) -> list:
     """
     Interleaves two lists of possibly different length. The goal is to interleave as evenly as possible.
-    :param list1: A list
-    :param list2: A list
-    :return: A combined list
+    :param list1: A list or GrainTable
+    :param list2: A list or GrainTable
+    :return: A combined list (a GrainTable if the inputs are GrainTables)
     """
+    if isinstance(list1, GrainTable):
+        indices = interleave(list(range(len(list1))), list(range(len(list1), len(list1) + len(list2))))
+        return GrainTable.concatenate([list1, list2]).take(indices)
+
     # Determine which list is larger and which is smaller. Also determine the size ratio between the two lists.
     if len(list1) < len(list2):
         larger_list = list2
@@ -275,12 +493,16 @@ def interleave(list1: list, list2: list) -> list:
 def interpolate(grains1: list, grains2: list, interpolations=None) -> list:
     """
     Creates a new list of grains that interpolates linearly between two existing grain lists.
-    :param grains1: A list of grains
-    :param grains2: A list of grains
+    :param grains1: A list of grains or a GrainTable
+    :param grains2: A list of grains or a GrainTable
     :param interpolations: The number of interpolation chunk pairs. If None, will be determined automatically.
     This parameter can be adjusted to change the smoothness of interpolation.
-    :return: An interpolated grains list
+    :return: An interpolated grains list (a GrainTable if the inputs are GrainTables)
     """
+    if isinstance(grains1, GrainTable):
+        indices = interpolate(list(range(len(grains1))), list(range(len(grains1), len(grains1) + len(grains2))), interpolations)
+        return GrainTable.concatenate([grains1, grains2]).take(indices)
+
     if interpolations is None:
         smaller_area = min(len(grains1), len(grains2))
         interpolations = int(np.ceil(np.sqrt(smaller_area * 2)))
@@ -321,7 +543,7 @@ def interpolate(grains1: list, grains2: list, interpolations=None) -> list:
     # Merge the grains
     newgrains = []
     for i in range(len(grains1_new)):
-        if len(grains1_new[i]) > 0 and len(grains2[i]) > 0:
+        if len(grains1_new[i]) > 0 and len(grains2_new[i]) > 0:
             newgrains += interleave(grains1_new[i], grains2_new[i])
         else:
             newgrains += grains1_new[i] + grains2_new[i]
@@ -329,24 +551,29 @@ def interpolate(grains1: list, grains2: list, interpolations=None) -> list:
     return newgrains
 
 
-def merge(grains: list, num_channels: int = 1, window_fn=np.hanning) -> np.ndarray:
+def merge(grains: list, num_channels: int = 1, window_fn=np.hanning, dtype=np.float64) -> np.ndarray:
     """
     Merges a list of grain dictionaries into an audio array
-    :param grains: A list of grain dictionaries {grain: , start_idx: , end_idx: , channel: }
+    :param grains: A list of grain dictionaries {grain: , start_idx: , end_idx: , channel: }, or a GrainTable
     :param num_channels: The number of channels
     :param window_fn: The window function
+    :param dtype: The dtype of the windows and the output array. np.float32 halves the memory of the merge buffer.
     :return: The merged array of grains
     """
+    if isinstance(grains, GrainTable):
+        return _merge_table(grains, num_channels, window_fn, dtype)
+
+    prefetch_grains(grains)
     max_idx = 0
     for tup in grains:
         max_idx = max(max_idx, tup["end_idx"])
     if num_channels > 1:
-        audio = np.zeros((num_channels, max_idx))
+        audio = np.zeros((num_channels, max_idx), dtype=dtype)
     else:
-        audio = np.zeros((max_idx))
+        audio = np.zeros((max_idx), dtype=dtype)
     # window_norm = np.zeros((num_channels, max_idx))
     for i in range(len(grains)):
-        window = window_fn(grains[i]["grain"].shape[-1])
+        window = get_window(window_fn, grains[i]["grain"].shape[-1], dtype)
         grain = grains[i]["grain"] * window
         grain_tools.merge_grain(audio, grain, grains[i]["start_idx"], grains[i]["end_idx"], grains[i]["channel"])
         # grain_tools.merge(window_norm, window, tup[2], end_idx, tup[1])
@@ -354,29 +581,198 @@ def merge(grains: list, num_channels: int = 1, window_fn=np.hanning) -> np.ndarr
     return audio
 
 
+def _merge_table(grains: GrainTable, num_channels: int = 1, window_fn=np.hanning, dtype=np.float64) -> np.ndarray:
+    """
+    Merges a GrainTable into an audio array. Grains are windowed in one batch per grain length
+    and accumulated with a single scatter-add, in grain order, so the output matches `merge`.
+    :param grains: A GrainTable with loaded audio and calculated positions
+    :param num_channels: The number of channels
+    :param window_fn: The window function
+    :param dtype: The dtype of the windows and the output array
+    :return: The merged array of grains
+    """
+    max_idx = int(np.max(grains["end_idx"])) if len(grains) > 0 else 0
+    if num_channels > 1:
+        audio = np.zeros((num_channels, max_idx), dtype=dtype)
+    else:
+        audio = np.zeros((max_idx), dtype=dtype)
+    if len(grains) == 0:
+        return audio
+    if np.any(grains["sample_offset"] < 0):
+        raise ValueError("The grain audio must be loaded before merging.")
+
+    windowed, target_idx, channel = _gather_grains(grains, np.arange(len(grains)), window_fn, dtype)
+    if num_channels > 1:
+        target_idx += channel * max_idx
+
+    np.add.at(audio.reshape(-1), target_idx, windowed)
+    audio = np.nan_to_num(audio)
+    return audio
+
+
+def _gather_grains(grains: GrainTable, rows: np.ndarray, window_fn=np.hanning, dtype=np.float64) -> tuple:
+    """
+    Windows the grains in some rows of a GrainTable, in one batch per grain length, and
+    flattens them in row order together with their output positions
+    :param grains: A GrainTable with loaded audio and calculated positions
+    :param rows: The rows to gather
+    :param window_fn: The window function
+    :param dtype: The dtype of the windows and the windowed samples
+    :return: A tuple of flat arrays (windowed samples, output index, channel)
+    """
+    lengths = grains["end_idx"][rows] - grains["start_idx"][rows]
+    flat_start = np.cumsum(lengths) - lengths
+    windowed = np.empty((int(np.sum(lengths))), dtype=dtype)
+    target_idx = np.empty((windowed.shape[-1]), dtype=np.int64)
+    channel = np.empty((windowed.shape[-1]), dtype=np.int64)
+    for grain_length in np.unique(lengths):
+        group = np.flatnonzero(lengths == grain_length)
+        frames = np.arange(grain_length)
+        flat_idx = flat_start[group, np.newaxis] + frames
+        windowed[flat_idx] = grains.samples[grains["sample_offset"][rows[group], np.newaxis] + frames] * get_window(window_fn, grain_length, dtype)
+        target_idx[flat_idx] = grains["start_idx"][rows[group], np.newaxis] + frames
+        channel[flat_idx] = grains["channel"][rows[group], np.newaxis]
+    return windowed, target_idx, channel
+
+
+def merge_blocks(grains: list, num_channels: int = 1, window_fn=np.hanning, block_size: int = 65536, max_gather: int = 2 ** 21, dtype=np.float64):
+    """
+    Merges grains into a sequence of fixed-size output blocks, in onset order. This is a streaming
+    version of `merge`: only the grains that overlap the current block are windowed, so memory depends
+    on the block size rather than the length of the output. Every output sample receives its
+    contributions in the same (grain) order as in `merge`, so the concatenated blocks match `merge`.
+    :param grains: A list of grain dictionaries {grain: , start_idx: , end_idx: , channel: }, or a GrainTable
+    :param num_channels: The number of channels
+    :param window_fn: The window function
+    :param block_size: The block length, in frames
+    :param max_gather: The maximum number of grain samples to window at once (GrainTable only)
+    :param dtype: The dtype of the windows and the blocks
+    :return: A generator of tuples (block start frame, block). Each block has shape (num_channels, frames).
+    """
+    is_table = isinstance(grains, GrainTable)
+    if is_table:
+        if len(grains) > 0 and np.any(grains["sample_offset"] < 0):
+            raise ValueError("The grain audio must be loaded before merging.")
+        start_idx = grains["start_idx"]
+        end_idx = grains["end_idx"]
+    else:
+        prefetch_grains(grains)
+        start_idx = np.fromiter((grain["start_idx"] for grain in grains), dtype=np.int64, count=len(grains))
+        end_idx = np.fromiter((grain["end_idx"] for grain in grains), dtype=np.int64, count=len(grains))
+    num_frames = int(np.max(end_idx)) if len(grains) > 0 else 0
+    max_length = int(np.max(end_idx - start_idx)) if len(grains) > 0 else 0
+    order = np.argsort(start_idx, kind="stable")
+    sorted_starts = start_idx[order]
+
+    for block_start in range(0, num_frames, block_size):
+        block_end = min(block_start + block_size, num_frames)
+        block = np.zeros((num_channels, block_end - block_start), dtype=dtype)
+        # The grains that start in (block_start - max_length, block_end) and end after block_start
+        candidates = order[np.searchsorted(sorted_starts, block_start - max_length, side="right"):np.searchsorted(sorted_starts, block_end)]
+        rows = np.sort(candidates[end_idx[candidates] > block_start])
+
+        if is_table:
+            lengths = end_idx[rows] - start_idx[rows]
+            chunk_start = 0
+            while chunk_start < rows.shape[-1]:
+                # Chunks are taken in row order, so the sums keep the grain order
+                chunk_end = chunk_start + max(1, int(np.searchsorted(np.cumsum(lengths[chunk_start:]), max_gather, side="right")))
+                windowed, target_idx, channel = _gather_grains(grains, rows[chunk_start:chunk_end], window_fn, dtype)
+                target_idx -= block_start
+                inside = (target_idx >= 0) & (target_idx < block.shape[-1])
+                np.add.at(block.reshape(-1), channel[inside] * block.shape[-1] + target_idx[inside], windowed[inside])
+                chunk_start = chunk_end
+        else:
+            for i in rows:
+                grain = grains[i]["grain"]
+                window = get_window(window_fn, grain.shape[-1], dtype)
+                low = max(start_idx[i], block_start) - start_idx[i]
+                high = min(start_idx[i] + grain.shape[-1], block_end) - start_idx[i]
+                block[grains[i]["channel"], start_idx[i] + low - block_start:start_idx[i] + high - block_start] += grain[low:high] * window[low:high]
+
+        yield block_start, np.nan_to_num(block)
+
+
+def merge_packed(samples: np.ndarray, start_idx: np.ndarray, channel: np.ndarray, num_channels: int = 1, window_fn=np.hanning, dtype=np.float64) -> np.ndarray:
+    """
+    Merges a packed matrix of equal-length grains into an audio array. This is a batched
+    version of `merge`: the grains are windowed with a single broadcast multiply and
+    accumulated with one scatter-add. The output is identical to `merge` for the same grains,
+    since every output sample receives its contributions in the same (grain) order.
+    :param samples: A 2D array of grain samples with shape (num_grains, grain_length)
+    :param start_idx: An array of start indices, one per grain
+    :param channel: An array of channel indices, one per grain
+    :param num_channels: The number of channels
+    :param window_fn: The window function
+    :param dtype: The dtype of the window and the output array
+    :return: The merged array of grains
+    """
+    start_idx = np.asarray(start_idx, dtype=np.int64)
+    channel = np.asarray(channel, dtype=np.int64)
+    grain_length = samples.shape[-1]
+    max_idx = int(np.max(start_idx)) + grain_length if start_idx.size > 0 else 0
+    if num_channels > 1:
+        audio = np.zeros((num_channels, max_idx), dtype=dtype)
+    else:
+        audio = np.zeros((max_idx), dtype=dtype)
+    if start_idx.size == 0:
+        return audio
+
+    windowed = samples * get_window(window_fn, grain_length, dtype)
+    target_idx = start_idx[:, np.newaxis] + np.arange(grain_length)
+    if num_channels > 1:
+        target_idx += channel[:, np.newaxis] * max_idx
+    elif np.any(channel != 0):
+        raise ValueError("Grains with a nonzero channel cannot be merged into a mono array.")
+
+    # np.add.at is unbuffered and walks the indices in order, so overlapping grains sum in grain order
+    np.add.at(audio.reshape(-1), target_idx.reshape(-1), windowed.reshape(-1))
+    audio = np.nan_to_num(audio)
+    return audio
+
+
+def pack_grains(grains: list) -> tuple:
+    """
+    Packs a list of grain dictionaries into arrays for `merge_packed`.
+    All grains must have the same length.
+    :param grains: A list of grain dictionaries {grain: , start_idx: , channel: }
+    :return: A tuple (samples, start_idx, channel)
+    """
+    prefetch_grains(grains)
+    samples = np.stack([grain["grain"] for grain in grains])
+    start_idx = np.fromiter((grain["start_idx"] for grain in grains), dtype=np.int64, count=len(grains))
+    channel = np.fromiter((grain["channel"] for grain in grains), dtype=np.int64, count=len(grains))
+    return samples, start_idx, channel
+
+
 def merge_crossfade(grains: list, merge_fraction: float = 0.5) -> np.ndarray:
     """
-    Merges several grain arrays and crossfades between them
+    Merges several grain arrays and crossfades between them. The result has the dtype of the first array.
     :param grains: A list of merged grain arrays
     :param merge_fraction: The fraction of each array that should overlap with the next array (or vice versa, depending on which array is smaller)
     :return: The merged array of grains
     """
     audio = grains[0]
     for i in range(1, len(grains)):
-        audio = grain_tools.crossfade(audio, grains[i], merge_fraction)
+        overlap_len = int(min(audio.shape[-1], grains[i].shape[-1]) * merge_fraction)
+        audio = grain_tools.crossfade(audio, grains[i], merge_fraction,
+                                      get_window(sine_fade, overlap_len, audio.dtype), get_window(cosine_fade, overlap_len, audio.dtype))
     return audio
 
 
 def randomize_param(grains: list, param: str, rng: random.Random, max_deviation: int, only_positive: bool = False):
     """
     Randomizes a grain parameter
-    :param grains: A list of grain dictionaries
+    :param grains: A list of grain dictionaries or a GrainTable
     :param param: The key to randomize
     :param rng: The random number generator to use
     :param max_deviation: The maximum deviation allowed
     :param only_positive: Whether or not only positive deviation is allowed
     """
     min_deviation = 0 if only_positive else -max_deviation
+    if isinstance(grains, GrainTable):
+        grains[param] += np.array([rng.randrange(min_deviation, max_deviation + 1) for _ in range(len(grains))], dtype=np.int64)
+        return
     for grain in grains:
         grain[param] += rng.randrange(min_deviation, max_deviation + 1)
 
@@ -384,19 +780,47 @@ def randomize_param(grains: list, param: str, rng: random.Random, max_deviation:
 def spread_across_channels(grains: list, num_channels: int = 2):
     """
     Spreads grains across `num_channels` channels
-    :param grains: A list of grains
+    :param grains: A list of grains or a GrainTable
     :param num_channels: The number of channels
     """
+    if isinstance(grains, GrainTable):
+        grains["channel"] = np.arange(len(grains)) % num_channels
+        return
+
     for i in range(len(grains)):
         grains[i]["channel"] = i % num_channels
 
 
+def _swap_permutation(num_grains: int, n: int, m: int) -> np.ndarray:
+    """
+    Computes the permutation produced by swapping grains i and i+m for every nth i, in order
+    :param num_grains: The number of grains
+    :param n: Every nth pair will be swapped
+    :param m: The distance between the grains in a pair
+    :return: The permutation as an index array
+    """
+    perm = np.arange(num_grains)
+    first = np.arange(0, num_grains - m, n)
+    if m % n != 0:
+        # the pairs are disjoint, so the swaps can be done at once
+        perm[first], perm[first + m] = perm[first + m], perm[first]
+    else:
+        # each swap moves a grain that the next swap will move again
+        for i in first:
+            perm[i], perm[i + m] = perm[i + m], perm[i]
+    return perm
+
+
 def swap_nth_adjacent_pair(grains: list, n: int):
     """
     Swaps every n adjacent grain pairs.
-    :param grains: A list of grains
+    :param grains: A list of grains or a GrainTable
     :param n: Every nth pair will be swapped
     """
+    if isinstance(grains, GrainTable):
+        grains.data = grains.data[_swap_permutation(len(grains), n, 1)]
+        return
+
     for i in range(0, len(grains)-1, n):
         temp = grains[i+1]
         grains[i+1] = grains[i]
@@ -406,9 +830,13 @@ def swap_nth_adjacent_pair(grains: list, n: int):
 def swap_nth_m_pair(grains: list, n: int, m: int):
     """
     Swaps every n grain pairs of grains spaced n apart
-    :param grains: A list of grains
+    :param grains: A list of grains or a GrainTable
     :param n: Every nth pair will be swapped
     """
+    if isinstance(grains, GrainTable):
+        grains.data = grains.data[_swap_permutation(len(grains), n, m)]
+        return
+
     for i in range(0, len(grains)-m, n):
         temp = grains[i+m]
         grains[i+m] = grains[i]
@@ -420,11 +848,18 @@ def swap_random_pair(grains: list, prob: float, rng: random.Random):
     Randomly swaps adjacent grain pairs, based on the probability value provided.
     If the grains list is a list of lists, the swap will take place with the next adjacent list,
     mod the number of lists present.
-    :param grains: A list of grains
+    :param grains: A list of grains or a GrainTable
     :param prob: The probability that any given pair of adjacent grains will be swapped
     :param rng: The random number generator to use
     """
-    if type(grains[0]) == list:
+    if isinstance(grains, GrainTable):
+        # Draw the decisions with the same rng calls as the list version, and reproduce its effect:
+        # each selected grain is copied forward into the next slot, so runs of selections fill forward.
+        swaps = [rng.choice(rng.choices((True, False), weights=(prob, 1-prob), k=10)) for _ in range(len(grains)-1)]
+        source = np.arange(len(grains))
+        source[1:][np.array(swaps, dtype=bool)] = 0
+        grains.data = grains.data[np.maximum.accumulate(source)]
+    elif type(grains[0]) == list:
         for i in range(len(grains)-1):
             next_idx = (i + 1) % len(grains)
             for j in range(len(grains[i])):
@@ -0,0 +1,140 @@
+"""
+File: grain_knn.py
+
+Description: Contains a nearest-neighbor search over the grain feature space. The feature vectors of
+every grain are read from the database once, normalized (z-scores), and saved in a .npz file. A KD-tree
+is built for each grain length on demand, so a target feature vector can be matched to the k closest
+grains without tuning BETWEEN ranges and rerunning SQL.
+"""
+
+import numpy as np
+import os
+from scipy.spatial import cKDTree
+from . import grain_sql
+
+# The default feature columns to search. NULL features (the frequency and MIDI note of unpitched grains)
+# are stored at the column mean, so they do not pull a grain towards or away from a target.
+KNN_FIELDS = [
+    "frequency", "energy", "spectral_centroid", "spectral_entropy", "spectral_flatness",
+    "spectral_kurtosis", "spectral_roll_off_50", "spectral_roll_off_75", "spectral_roll_off_90",
+    "spectral_roll_off_95", "spectral_skewness", "spectral_slope", "spectral_variance"
+]
+
+
+class GrainKNN:
+    """
+    A nearest-neighbor index of grain feature vectors
+    """
+    def __init__(self, ids: np.ndarray, lengths: np.ndarray, features: np.ndarray, mean: np.ndarray, std: np.ndarray, fields: list):
+        """
+        Initializes the index. Use `build` or `load` to create an index.
+        :param ids: The grain ids
+        :param lengths: The grain lengths
+        :param features: The normalized feature matrix, with one row per grain
+        :param mean: The mean of each feature column
+        :param std: The standard deviation of each feature column
+        :param fields: The feature column names
+        """
+        self.ids = ids
+        self.lengths = lengths
+        self.features = features
+        self.mean = mean
+        self.std = std
+        self.fields = list(fields)
+        self.trees = {}
+
+    @classmethod
+    def build(cls, cursor, fields: list = None, batch_size: int = 65536):
+        """
+        Builds the index from the database
+        :param cursor: A database cursor
+        :param fields: The feature columns to search
+        :param batch_size: The number of rows to fetch at a time
+        :return: The GrainKNN
+        """
+        fields = fields if fields is not None else KNN_FIELDS
+        for field in fields:
+            if field not in grain_sql.FIELDS:
+                raise ValueError(f"Unknown grain field {field}.")
+        cursor.execute(f"SELECT id, length, {', '.join(fields)} FROM grains ORDER BY id;")
+        batches = []
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if len(rows) == 0:
+                break
+            batches.append(np.array(rows, dtype=np.float64))
+        data = np.vstack(batches) if len(batches) > 0 else np.zeros((0, len(fields) + 2))
+        ids = data[:, 0].astype(np.int64)
+        lengths = data[:, 1].astype(np.int64)
+        features = data[:, 2:]
+
+        # Normalize each column, then put the NULL features at the column mean
+        mean = np.nanmean(features, axis=0) if features.shape[0] > 0 else np.zeros((len(fields)))
+        std = np.nanstd(features, axis=0) if features.shape[0] > 0 else np.ones((len(fields)))
+        mean = np.nan_to_num(mean)
+        std = np.where(np.nan_to_num(std) > 0, np.nan_to_num(std), 1.0)
+        features = np.nan_to_num((features - mean) / std)
+        return cls(ids, lengths, features, mean, std, fields)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Loads an index saved with `save`
+        :param path: The .npz file path
+        :return: The GrainKNN
+        """
+        with np.load(path) as data:
+            return cls(data["ids"], data["lengths"], data["features"], data["mean"], data["std"], [str(field) for field in data["fields"]])
+
+    def save(self, path: str):
+        """
+        Saves the index to a .npz file
+        :param path: The .npz file path
+        """
+        temp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(temp_path, ids=self.ids, lengths=self.lengths, features=self.features, mean=self.mean, std=self.std, fields=np.array(self.fields))
+        os.replace(temp_path, path)
+
+    def _tree(self, length: int = None) -> tuple:
+        """
+        Gets the KD-tree for a grain length, building it if necessary
+        :param length: The grain length, or None for all grains
+        :return: A tuple (KD-tree, grain ids in tree order)
+        """
+        if length not in self.trees:
+            if length is None:
+                ids, features = self.ids, self.features
+            else:
+                mask = self.lengths == length
+                ids, features = self.ids[mask], self.features[mask]
+            self.trees[length] = (cKDTree(features), ids)
+        return self.trees[length]
+
+    def normalize(self, target) -> np.ndarray:
+        """
+        Normalizes a target feature vector
+        :param target: A dictionary of field -> value, or a vector (or matrix of vectors) in `fields` order.
+        Fields missing from a dictionary, and NaN values, are treated as the column mean.
+        :return: The normalized feature vector(s)
+        """
+        if type(target) == dict:
+            target = np.array([target[field] if field in target and target[field] is not None else np.nan for field in self.fields], dtype=np.float64)
+        return np.nan_to_num((np.asarray(target, dtype=np.float64) - self.mean) / self.std)
+
+    def nearest(self, target, k: int = 1, length: int = None) -> np.ndarray:
+        """
+        Finds the grains closest to a target feature vector
+        :param target: A dictionary of field -> value, or a vector (or matrix of vectors) in `fields` order
+        :param k: The number of grains to find
+        :param length: If provided, only grains of this length are searched
+        :return: The ids of the k closest grains, closest first. For a matrix of targets, one row of ids per target.
+        If there are fewer than k grains, the array is shorter than k.
+        """
+        tree, ids = self._tree(length)
+        k = min(k, ids.shape[0])
+        if k == 0:
+            return np.zeros(np.asarray(self.normalize(target)).shape[:-1] + (0,), dtype=np.int64)
+        _, idx = tree.query(self.normalize(target), k=k)
+        if k == 1:
+            idx = np.expand_dims(idx, -1)
+        return ids[idx]
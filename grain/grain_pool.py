@@ -0,0 +1,178 @@
+"""
+File: grain_pool.py
+
+Description: Contains the SharedGrainPool, which holds grain categories and their samples in
+shared memory so that several render processes can use them without each process copying the
+records or decoding the source audio again. The pool is created once in the parent process and
+passed to the workers; the workers attach to the shared blocks without copying them.
+"""
+
+import numpy as np
+from multiprocessing import shared_memory
+from . import grain_sql
+from .grain_table import GrainTable, GRAIN_DTYPE
+
+# The record layout in shared memory. The file column holds an index into the pool's list of file paths,
+# since Python string objects cannot be shared.
+POOL_DTYPE = np.dtype([(name, np.int64 if name == "file" else GRAIN_DTYPE[name]) for name in GRAIN_DTYPE.names])
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    Attaches to an existing shared memory block without taking ownership of it
+    :param name: The name of the block
+    :return: The SharedMemory object
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13, attaching registers the block with the resource tracker. Worker processes
+        # share the creating process's tracker, so the block is still only removed by `unlink`.
+        return shared_memory.SharedMemory(name=name)
+
+
+def _share(array: np.ndarray) -> tuple:
+    """
+    Copies an array into a new shared memory block
+    :param array: The array
+    :return: A tuple (SharedMemory object, array view of the block)
+    """
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    view[...] = array
+    return block, view
+
+
+class SharedGrainPool:
+    """
+    A list of grain categories whose records and samples live in shared memory.
+    Index the pool to get a category, and use `take` on a category to select grains as a GrainTable.
+    The process that creates the pool must call `close` and `unlink` when the workers are finished.
+    """
+    def __init__(self, categories: list, source_dir, decode_cache=None, grain_store=None, num_workers: int = 1):
+        """
+        Loads grain categories and their samples into shared memory
+        :param categories: A list of grain categories (lists of grain dictionaries or GrainTables)
+        :param source_dir: The directory that contains the audio files (or a list of directories, or a SourceIndex)
+        :param decode_cache: An optional DecodeCache
+        :param grain_store: An optional GrainStore. If every grain is in the store, the workers
+        read the samples from the store's memory map instead of a shared memory block.
+        :param num_workers: The number of source files to decode concurrently
+        """
+        tables = [category if isinstance(category, GrainTable) else GrainTable.from_dicts(category) for category in categories]
+        lengths = np.array([len(table) for table in tables], dtype=np.int64)
+        self.bounds = np.concatenate(([0], np.cumsum(lengths)))
+        table = GrainTable(np.concatenate([table.data for table in tables]))
+        grain_sql.read_grains_from_file(table, source_dir, decode_cache, num_workers, grain_store=grain_store)
+
+        # Encode the file paths as integer codes
+        self.files, codes = np.unique(table["file"].astype(str), return_inverse=True)
+        self.files = self.files.tolist()
+        records = np.zeros((len(table)), dtype=POOL_DTYPE)
+        for name in POOL_DTYPE.names:
+            records[name] = codes if name == "file" else table[name]
+
+        self.store_path = None
+        self._samples_block = None
+        if grain_store is not None and table.samples is grain_store.samples:
+            self.store_path = grain_store.samples_path
+            self.samples = table.samples
+        else:
+            self._samples_block, self.samples = _share(table.samples)
+        self._records_block, self.records = _share(records)
+        self._owner = True
+
+    def __getstate__(self):
+        state = {
+            "bounds": self.bounds,
+            "files": self.files,
+            "store_path": self.store_path,
+            "records": (self._records_block.name, self.records.shape),
+            "samples": (self._samples_block.name, self.samples.shape) if self._samples_block is not None else None,
+        }
+        return state
+
+    def __setstate__(self, state):
+        self.bounds = state["bounds"]
+        self.files = state["files"]
+        self.store_path = state["store_path"]
+        self._owner = False
+        name, shape = state["records"]
+        self._records_block = _attach(name)
+        self.records = np.ndarray(shape, dtype=POOL_DTYPE, buffer=self._records_block.buf)
+        if state["samples"] is not None:
+            name, shape = state["samples"]
+            self._samples_block = _attach(name)
+            self.samples = np.ndarray(shape, dtype=np.float32, buffer=self._samples_block.buf)
+        else:
+            self._samples_block = None
+            self.samples = np.memmap(self.store_path, dtype=np.float32, mode="r")
+
+    def __len__(self):
+        return self.bounds.shape[0] - 1
+
+    def __getitem__(self, idx: int):
+        """
+        Gets a grain category
+        :param idx: The category index
+        :return: The category, a view of the shared records
+        """
+        if idx < 0 or idx >= len(self):
+            raise IndexError(f"Category index {idx} is out of range.")
+        return PoolCategory(self, self.bounds[idx], self.bounds[idx + 1])
+
+    def close(self):
+        """
+        Detaches this process from the shared memory blocks
+        """
+        self.records = None
+        self.samples = None
+        for block in (self._records_block, self._samples_block):
+            if block is not None:
+                block.close()
+
+    def unlink(self):
+        """
+        Removes the shared memory blocks. Only the process that created the pool should call this,
+        after the workers are finished.
+        """
+        if self._owner:
+            for block in (self._records_block, self._samples_block):
+                if block is not None:
+                    block.unlink()
+
+
+class PoolCategory:
+    """
+    A grain category in a SharedGrainPool. Grains are selected with `take`, which copies only
+    the selected records; the selected grains' audio stays in shared memory.
+    """
+    def __init__(self, pool: SharedGrainPool, start: int, end: int):
+        """
+        Initializes the category
+        :param pool: The pool
+        :param start: The index of the category's first record in the pool
+        :param end: The index after the category's last record in the pool
+        """
+        self.pool = pool
+        self.start = int(start)
+        self.end = int(end)
+
+    def __len__(self):
+        return self.end - self.start
+
+    def take(self, indices) -> GrainTable:
+        """
+        Selects grains by index. Indices may repeat.
+        :param indices: An index array
+        :return: A GrainTable of the selected grains, whose sample buffer is the shared pool buffer
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if np.any((indices < 0) | (indices >= len(self))):
+            raise IndexError("Grain index out of range.")
+        records = self.pool.records[self.start + indices]
+        table = GrainTable.empty(indices.shape[0])
+        for name in POOL_DTYPE.names:
+            table[name] = np.array(self.pool.files, dtype=object)[records["file"]] if name == "file" else records[name]
+        table.samples = self.pool.samples
+        return table
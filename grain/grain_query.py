@@ -0,0 +1,127 @@
+"""
+File: grain_query.py
+
+Description: Contains a declarative query engine for selecting categories of grains.
+Each category is described by a GrainQuery (feature ranges, NULL features, tags and an energy threshold),
+and all categories are fetched in one pass with a single UNION ALL statement that tags each row
+with its category index.
+"""
+
+import numpy as np
+from . import grain_sql
+from .grain_table import GrainTable
+
+
+class GrainQuery:
+    """
+    Describes one category of grains: a box in feature space plus tag and energy constraints
+    """
+    def __init__(self, ranges: dict, tags: list, min_energy: float = None, null_fields: list = None):
+        """
+        Initializes the query
+        :param ranges: A dictionary of column name -> (low, high). Each column must lie in [low, high].
+        :param tags: A list of tags. A grain matches if it has any of the tags.
+        :param min_energy: If provided, the grain energy must be greater than this value
+        :param null_fields: A list of columns that must be NULL (for example, ["frequency"] for unpitched grains)
+        """
+        self.ranges = ranges
+        self.tags = tags
+        self.min_energy = min_energy
+        self.null_fields = null_fields if null_fields is not None else []
+
+    def where(self, rtree=None) -> tuple:
+        """
+        Builds the WHERE conditions for this query, not including the grain length
+        :param rtree: An optional FeatureRTree to prefilter the feature ranges with
+        :return: A tuple (list of SQL conditions, list of parameters)
+        """
+        conditions = []
+        params = []
+        if rtree is not None:
+            condition, rtree_params = rtree.condition(self)
+            if condition is not None:
+                conditions.append(condition)
+                params += rtree_params
+        for field, (low, high) in self.ranges.items():
+            conditions.append(f"(grains.{field} BETWEEN ? AND ?)")
+            params += [low, high]
+        for field in self.null_fields:
+            conditions.append(f"(grains.{field} IS NULL)")
+        if self.min_energy is not None:
+            conditions.append("(grains.energy > ?)")
+            params.append(self.min_energy)
+        if len(self.tags) > 0:
+            conditions.append(f"grains.id IN (SELECT grain_id FROM tags WHERE tag IN ({', '.join('?' for _ in self.tags)}))")
+            params += list(self.tags)
+        return conditions, params
+
+
+def build_sql(length: int, queries: list, rtree=None) -> tuple:
+    """
+    Builds a single UNION ALL statement for a list of queries. Each row of the result starts
+    with the index of the query it matched, followed by the grain fields in `grain_sql.FIELDS` order.
+    A grain that matches several queries appears once for each of them.
+    :param length: The target grain length
+    :param queries: A list of GrainQuery objects
+    :param rtree: An optional FeatureRTree to prefilter the feature ranges with
+    :return: A tuple (SQL, parameters)
+    """
+    columns = ", ".join(f"{grain_sql.field_sql(field)} AS {field}" for field in grain_sql.FIELDS)
+    selects = []
+    params = []
+    for i, query in enumerate(queries):
+        conditions, query_params = query.where(rtree)
+        selects.append(f"SELECT {i} AS category, {columns} FROM grains {grain_sql.FILE_JOIN} WHERE " + " AND ".join(["(grains.length = ?)"] + conditions))
+        params += [length] + query_params
+    return "\nUNION ALL\n".join(selects) + "\nORDER BY category, id;", params
+
+
+def run_queries(cursor, length: int, queries: list, rtree=None, as_table: bool = False, batch_size: int = 65536) -> list:
+    """
+    Runs a list of category queries in one pass
+    :param cursor: A database cursor
+    :param length: The target grain length
+    :param queries: A list of GrainQuery objects
+    :param rtree: An optional FeatureRTree (see `grain_rtree`) to prefilter the feature ranges with
+    :param as_table: If True, each category is returned as a GrainTable instead of a list of grain dictionaries.
+    The result set is read in `fetchmany` batches straight into columns, without building a dictionary per row.
+    :param batch_size: The number of rows to fetch at a time when as_table is True
+    :return: A list of grain dictionary lists (or GrainTables), one per query
+    """
+    sql, params = build_sql(length, queries, rtree)
+    cursor.execute(sql, params)
+    if as_table:
+        grain_entry_categories = _fetch_tables(cursor, len(queries), batch_size)
+    else:
+        grain_entry_categories = [[] for _ in range(len(queries))]
+        for record in cursor.fetchall():
+            grain_entry_categories[record[0]].append({grain_sql.FIELDS[i]: record[i+1] for i in range(len(grain_sql.FIELDS))})
+    for i, entry_category in enumerate(grain_entry_categories):
+        if len(entry_category) == 0:
+            raise Exception(f"No grains found for index {i}.")
+    return grain_entry_categories
+
+
+def _fetch_tables(cursor, num_queries: int, batch_size: int) -> list:
+    """
+    Reads the result of a `build_sql` statement into one GrainTable per query
+    :param cursor: A database cursor that has executed the statement
+    :param num_queries: The number of queries in the statement
+    :param batch_size: The number of rows to fetch at a time
+    :return: A list of GrainTables, one per query. The tables are disjoint views of one record array.
+    """
+    tables = []
+    categories = []
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if len(rows) == 0:
+            break
+        columns = list(zip(*rows))
+        categories.append(np.array(columns[0], dtype=np.int64))
+        tables.append(GrainTable.from_columns(columns[1:]))
+    if len(tables) == 0:
+        return [GrainTable.empty(0) for _ in range(num_queries)]
+    table = GrainTable(np.concatenate([table.data for table in tables]))
+    # The rows are ordered by category, so each category is a contiguous slice
+    bounds = np.searchsorted(np.concatenate(categories), np.arange(num_queries + 1))
+    return [table[bounds[i]:bounds[i+1]] for i in range(num_queries)]
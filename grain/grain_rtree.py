@@ -0,0 +1,164 @@
+"""
+File: grain_rtree.py
+
+Description: Contains tools for an SQLite R*Tree index over the grain feature space. The R*Tree is a
+virtual table that mirrors up to five feature columns of the grains table, so that category queries
+can find the grains inside a multi-range box with one logarithmic lookup instead of filtering one
+range at a time. Triggers on the grains table keep the R*Tree in sync as grains are inserted, updated
+and deleted.
+"""
+
+# The default feature columns to mirror. An SQLite R*Tree has at most 5 dimensions.
+RTREE_FIELDS = ["spectral_centroid", "spectral_flatness", "spectral_roll_off_50", "spectral_roll_off_75", "frequency"]
+
+# The R*Tree cannot store NULL, so NULL features (for example, the frequency of unpitched grains) are stored as this value
+NULL_VALUE = -1.0
+
+
+class FeatureRTree:
+    """
+    Describes an R*Tree that mirrors feature columns of the grains table.
+    The R*Tree stores 32-bit floats, rounded outward, so it is used as a conservative prefilter:
+    the category queries keep their exact conditions on the grains table.
+    """
+    def __init__(self, fields: list = None, table: str = "grains_rtree"):
+        """
+        Initializes the R*Tree description
+        :param fields: The feature columns to mirror (at most 5)
+        :param table: The name of the R*Tree virtual table
+        """
+        self.fields = fields if fields is not None else RTREE_FIELDS
+        self.table = table
+        if len(self.fields) > 5:
+            raise ValueError("An SQLite R*Tree can have at most 5 dimensions.")
+
+    @classmethod
+    def from_db(cls, cursor, table: str = "grains_rtree", require_current: bool = False):
+        """
+        Reads the description of an existing R*Tree from the database
+        :param cursor: A database cursor
+        :param table: The name of the R*Tree virtual table
+        :param require_current: If True, None is returned unless the R*Tree holds exactly the grains
+        in the grains table (see `is_current`)
+        :return: The FeatureRTree, or None if the table does not exist
+        """
+        cursor.execute(f"PRAGMA table_info({table});")
+        columns = [row[1] for row in cursor.fetchall()]
+        if len(columns) == 0:
+            return None
+        rtree = cls([column[:-len("_min")] for column in columns[1::2]], table)
+        if require_current and not rtree.is_current(cursor):
+            print(f"{table} is out of date, so it is not used. Run rtree_table.py to refresh it.")
+            return None
+        return rtree
+
+    def _bounds(self, prefix: str = "") -> str:
+        """
+        Builds the R*Tree bounds for a grain row
+        :param prefix: The prefix of the grains columns (for example, "NEW." in a trigger)
+        :return: The SQL expressions
+        """
+        return ", ".join(f"IFNULL({prefix}{field}, {NULL_VALUE}), IFNULL({prefix}{field}, {NULL_VALUE})" for field in self.fields)
+
+    def _select(self) -> str:
+        """
+        Builds the SELECT that produces R*Tree rows from the grains table
+        :return: The SQL
+        """
+        return f"SELECT id, {self._bounds()} FROM grains"
+
+    def _create_triggers(self, cursor):
+        """
+        Creates the triggers that keep the R*Tree in sync with the grains table
+        :param cursor: The cursor for executing SQL
+        """
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {self.table}_insert AFTER INSERT ON grains BEGIN
+                INSERT OR REPLACE INTO {self.table} VALUES (NEW.id, {self._bounds("NEW.")});
+            END;
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {self.table}_update AFTER UPDATE OF id, {', '.join(self.fields)} ON grains BEGIN
+                DELETE FROM {self.table} WHERE id = OLD.id;
+                INSERT OR REPLACE INTO {self.table} VALUES (NEW.id, {self._bounds("NEW.")});
+            END;
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {self.table}_delete AFTER DELETE ON grains BEGIN
+                DELETE FROM {self.table} WHERE id = OLD.id;
+            END;
+        """)
+
+    def _drop_triggers(self, cursor):
+        """
+        Drops the sync triggers
+        :param cursor: The cursor for executing SQL
+        """
+        for name in ("insert", "update", "delete"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {self.table}_{name};")
+
+    def is_current(self, cursor) -> bool:
+        """
+        Checks that the R*Tree holds the same grains as the grains table (the same count and maximum id)
+        :param cursor: A database cursor
+        :return: Whether the R*Tree is current
+        """
+        cursor.execute(f"SELECT COUNT(*), MAX(id) FROM {self.table};")
+        rtree_state = cursor.fetchone()
+        cursor.execute("SELECT COUNT(*), MAX(id) FROM grains;")
+        return tuple(rtree_state) == tuple(cursor.fetchone())
+
+    def build(self, db, cursor):
+        """
+        Creates (or recreates) the R*Tree, fills it from the grains table, and creates the sync triggers
+        :param db: A connection to a SQLite database
+        :param cursor: The cursor for executing SQL
+        """
+        columns = ", ".join(f"{field}_min, {field}_max" for field in self.fields)
+        self._drop_triggers(cursor)
+        cursor.execute(f"DROP TABLE IF EXISTS {self.table};")
+        cursor.execute(f"CREATE VIRTUAL TABLE {self.table} USING rtree(id, {columns});")
+        cursor.execute(f"INSERT INTO {self.table} {self._select()};")
+        num_grains = cursor.rowcount
+        self._create_triggers(cursor)
+        db.commit()
+        print(f"Built {self.table} with {num_grains} grains")
+
+    def refresh(self, db, cursor):
+        """
+        Brings the R*Tree in sync with the grains table by adding new grains and removing deleted grains,
+        and creates the sync triggers if they are missing (R*Trees built before the triggers existed).
+        Grains whose feature values were changed in place without the triggers need a full rebuild.
+        :param db: A connection to a SQLite database
+        :param cursor: The cursor for executing SQL
+        """
+        cursor.execute(f"INSERT INTO {self.table} {self._select()} WHERE id NOT IN (SELECT id FROM {self.table});")
+        added = cursor.rowcount
+        cursor.execute(f"DELETE FROM {self.table} WHERE id NOT IN (SELECT id FROM grains);")
+        removed = cursor.rowcount
+        self._create_triggers(cursor)
+        db.commit()
+        print(f"Refreshed {self.table}: added {added} grains, removed {removed} grains")
+
+    def condition(self, query) -> tuple:
+        """
+        Builds a prefilter condition for a category query, using the query's ranges
+        and NULL fields that the R*Tree mirrors
+        :param query: A GrainQuery
+        :return: A tuple (SQL condition, parameters), or (None, []) if the R*Tree does not help this query
+        """
+        conditions = []
+        params = []
+        for field in self.fields:
+            if field in query.ranges:
+                low, high = query.ranges[field]
+            elif field in query.null_fields:
+                low, high = NULL_VALUE, NULL_VALUE
+            else:
+                continue
+            # overlap test, since the stored bounds are rounded outward to 32-bit floats
+            conditions.append(f"{field}_max >= ? AND {field}_min <= ?")
+            params += [low, high]
+        if len(conditions) == 0:
+            return None, []
+        return f"grains.id IN (SELECT id FROM {self.table} WHERE {' AND '.join(conditions)})", params
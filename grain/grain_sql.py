@@ -4,15 +4,22 @@ File: grain_sql.py
 Description: Works with SQL database for granulation
 """
 
+import concurrent.futures
+import itertools
 import sqlite3
+import time
 import aus.audiofile as audiofile
 import numpy as np
 import os
 import pedalboard as pb
+from .decode_cache import merge_spans, read_spans
+from .source_index import SourceIndex
 
 
+# The grain fields, in the order the queries select them. The file path lives in the files table
+# and is selected through a join (see `field_sql`).
 FIELDS = [
-    "id", "file", "start_frame", "end_frame", "length", "sample_rate", "grain_duration",
+    "id", "file", "file_id", "start_frame", "end_frame", "length", "sample_rate", "grain_duration",
     "frequency", "midi", "energy", "spectral_centroid", "spectral_entropy", "spectral_flatness",
     "spectral_kurtosis", "spectral_roll_off_50", "spectral_roll_off_75",
     "spectral_roll_off_90", "spectral_roll_off_95", "spectral_skewness", "spectral_slope",
@@ -20,6 +27,25 @@ FIELDS = [
     "spectral_variance"
 ]
 
+# The fields of a grain record for ingestion. The file value is the source file path;
+# the id is assigned by the database and the file id is looked up from the path.
+INGEST_FIELDS = [field for field in FIELDS if field not in ("id", "file_id")]
+
+# The files table. Each source file is stored once, and grains refer to it by id.
+FILE_FIELDS = ["id", "path", "sample_rate", "frames", "mtime"]
+
+# The join that provides the file path for grain queries
+FILE_JOIN = "INNER JOIN files ON files.id = grains.file_id"
+
+
+def field_sql(field: str) -> str:
+    """
+    Gets the SQL expression for a grain field. Queries that select the file path must use FILE_JOIN.
+    :param field: The field name (see FIELDS)
+    :return: The SQL expression
+    """
+    return "files.path" if field == "file" else f"grains.{field}"
+
 
 def connect_to_db(path):
     """
@@ -39,87 +65,512 @@ def find_path(database_path, parent_directory) -> str:
     Searches the parent directory for a file that matches the file name in the database.
     Note:
     - The file name must match exactly the file name on this computer, including file extension and case.
-    - If there are multiple files located somewhere under the provided parent directory, this function might
-      not find the right file. Don't have duplicate file names in the database.
+    - If there are multiple files with the same name under the provided parent directory, the match
+      is reported as ambiguous and no path is returned. Don't have duplicate file names in the database.
+    - This walks the parent directory on every call. To resolve many paths, build a SourceIndex once
+      and pass it as the parent directory.
     :param database_path: The path of the file in the database
-    :param parent_directory: The directory containing the file
+    :param parent_directory: The directory containing the file, a list of directories, or a SourceIndex
     :return: The actual file path on this machine
     """
-    # Need to compensate for os.path.split() not working properly on paths for other platform
-    idx = len(database_path) - 1
-    while idx >= 0:
-        if database_path[idx] == "\\" or database_path[idx] == "/":
-            break
-        idx -= 1
-    if idx >= 0:
-        database_path = database_path[idx+1:]
-    # print(f"Trying to find file {database_path}")
-    if type(parent_directory) == list:
-        for dir in parent_directory:
-            for path, _, files in os.walk(dir):
-                for file in files:
-                    if database_path in file:
-                        return os.path.join(path, file)
-    elif type(parent_directory) == str:
-        for path, _, files in os.walk(parent_directory):
-            for file in files:
-                if database_path in file:
-                    return os.path.join(path, file)
-
-    return ""
-
-
-def read_grains_from_file(grain_entries: list, source_dir):
+    if not isinstance(parent_directory, SourceIndex):
+        parent_directory = SourceIndex(parent_directory)
+    return parent_directory.resolve(database_path)
+
+
+def read_grains_from_file(grain_entries: list, source_dir, decode_cache=None, num_workers: int = 1, max_inflight_bytes: int = 512 * 1024 ** 2, grain_store=None,
+                          lazy: bool = False):
     """
     Extracts the corresponding grains from database records.
-    :param grain_entries: The grain records to use
-    :param source_dir: The directory that contains the audio files to extract grains from.
-    This is needed because this might not be the directory the audio files were contained
-    in when the granulation analysis was performed.
+    :param grain_entries: The grain records to use (a list of grain dictionaries or a GrainTable)
+    :param source_dir: The directory that contains the audio files to extract grains from
+    (or a list of directories, or a SourceIndex). This is needed because this might not be
+    the directory the audio files were contained in when the granulation analysis was performed.
+    :param decode_cache: An optional DecodeCache. If provided, decoded source audio is reused
+    across renders and processes instead of being decoded again.
+    :param num_workers: The number of source files to decode concurrently
+    :param max_inflight_bytes: The approximate limit on the grain audio held by files
+    that are being decoded but not yet stored. At least one file is always in flight.
+    :param grain_store: An optional GrainStore. Grains found in the store with the expected length
+    (end_frame - start_frame) are read from it as zero-copy slices; the remaining grains are read from
+    the source audio.
+    :param lazy: If True, the grain dictionaries in the list are replaced by LazyGrain records, which load
+    their audio on first access or when a merge prefetches them (see `GrainLoader`). Grains that are
+    removed before merging are never loaded. A GrainTable is always read immediately.
     """
-    # Group the grains by source file
+    if not isinstance(source_dir, SourceIndex):
+        source_dir = SourceIndex(source_dir)
+
+    if lazy and type(grain_entries) == list:
+        GrainLoader(source_dir, decode_cache, num_workers, max_inflight_bytes, grain_store).attach(grain_entries)
+        return
+
+    if type(grain_entries) != list:
+        _read_grains_into_table(grain_entries, source_dir, decode_cache, num_workers, max_inflight_bytes, grain_store)
+        return
+
+    stored = np.full((len(grain_entries)), -1, dtype=np.int64)
+    if grain_store is not None:
+        stored, stored_lengths = grain_store.lookup([grain["id"] for grain in grain_entries],
+                                                    [grain["end_frame"] - grain["start_frame"] for grain in grain_entries])
+        for i in np.flatnonzero(stored >= 0):
+            grain_entries[i]["grain"] = grain_store.samples[stored[i]:stored[i] + stored_lengths[i]]
+
+    # Group the grains by source file id
     grain_groups = {}
     for i, grain in enumerate(grain_entries):
-        if grain["file"] not in grain_groups:
-            grain_groups[grain["file"]] = []
-        grain_groups[grain["file"]].append(i)
-    
-    for audio_file, grain_list in grain_groups.items():
+        if stored[i] >= 0:
+            continue
+        if grain["file_id"] not in grain_groups:
+            grain_groups[grain["file_id"]] = []
+        grain_groups[grain["file_id"]].append(i)
+
+    jobs = []
+    for grain_list in grain_groups.values():
+        audio_file = grain_entries[grain_list[0]]["file"]
+        starts = [grain_entries[idx]["start_frame"] for idx in grain_list]
+        ends = [grain_entries[idx]["end_frame"] for idx in grain_list]
+        jobs.append((audio_file, starts, ends, grain_list))
+
+    def store(grain_list, grains):
+        for idx, grain in zip(grain_list, grains):
+            grain_entries[idx]["grain"] = grain
+
+    _load_grain_groups(jobs, source_dir, decode_cache, store, num_workers, max_inflight_bytes)
+
+
+def _read_grains_into_table(table, source_dir, decode_cache=None, num_workers: int = 1, max_inflight_bytes: int = 512 * 1024 ** 2, grain_store=None):
+    """
+    Extracts the grains for a GrainTable into a new shared sample buffer.
+    Records that refer to the same grain id share one slot in the buffer.
+    If every grain is in the grain store, the table uses the store's samples directly.
+    :param table: The GrainTable
+    :param source_dir: A SourceIndex of the directories that contain the audio files
+    :param decode_cache: An optional DecodeCache
+    :param num_workers: The number of source files to decode concurrently
+    :param max_inflight_bytes: The approximate limit on grain audio in flight
+    :param grain_store: An optional GrainStore
+    """
+    ids, first, inverse = np.unique(table["id"], return_index=True, return_inverse=True)
+    lengths = table["end_frame"][first] - table["start_frame"][first]
+    stored = np.full(ids.shape, -1, dtype=np.int64)
+    if grain_store is not None:
+        stored, _ = grain_store.lookup(ids, lengths)
+        if np.all(stored >= 0):
+            table["sample_offset"] = stored[inverse]
+            table.samples = grain_store.samples
+            return
+
+    offsets = np.cumsum(lengths) - lengths
+    samples = np.zeros((int(np.sum(lengths))), dtype=np.float32)
+    for slot in np.flatnonzero(stored >= 0):
+        samples[offsets[slot]:offsets[slot] + lengths[slot]] = grain_store.samples[stored[slot]:stored[slot] + lengths[slot]]
+
+    # Group the unique grains by source file id, in order of first appearance
+    pending = np.flatnonzero(stored < 0)
+    _, group_first, group_idx = np.unique(table["file_id"][first[pending]], return_index=True, return_inverse=True)
+    order = np.argsort(group_idx, kind="stable")
+    bounds = np.searchsorted(group_idx[order], np.arange(group_first.shape[0] + 1))
+    jobs = []
+    for group in np.argsort(group_first, kind="stable"):
+        slot_list = pending[order[bounds[group]:bounds[group + 1]]]
+        rows = first[slot_list]
+        jobs.append((table["file"][rows[0]], table["start_frame"][rows], table["end_frame"][rows], slot_list))
+
+    def store(slot_list, grains):
+        for slot, grain in zip(slot_list, grains):
+            samples[offsets[slot]:offsets[slot] + grain.shape[-1]] = grain
+
+    _load_grain_groups(jobs, source_dir, decode_cache, store, num_workers, max_inflight_bytes)
+    table["sample_offset"] = offsets[inverse]
+    table.samples = samples
+
+
+def _load_grain_groups(jobs: list, source_dir: SourceIndex, decode_cache, store, num_workers: int = 1, max_inflight_bytes: int = 512 * 1024 ** 2):
+    """
+    Reads the grains for each source file and hands them to `store` as they arrive.
+    Missing files are reported up front, in job order, so the report does not depend on
+    the order in which the workers finish.
+    :param jobs: A list of tuples (database file path, start frames, end frames, keys)
+    :param source_dir: A SourceIndex of the directories that contain the audio files
+    :param decode_cache: An optional DecodeCache
+    :param store: A function store(keys, grains) that stores the grain arrays for a job
+    :param num_workers: The number of source files to decode concurrently
+    :param max_inflight_bytes: The approximate limit on grain audio in flight
+    """
+    found = []
+    for audio_file, starts, ends, keys in jobs:
         path = find_path(audio_file, source_dir)
         if not os.path.exists(path):
-            print(f"Could not find path {path} for file {grain['file']}")
-            print(f"The source directory was {source_dir}")
+            print(f"Could not find path {path} for file {audio_file}")
+            print(f"The source directory was {source_dir.source_dirs}")
         else:
-            #audio = audiofile.read(path, 44100)
-            with pb.io.AudioFile(path).resampled_to(44100) as f:
-                audio = f.read(f.frames)
-                if audio.ndim == 1:
-                    audio = np.reshape(audio, (1, audio.shape[0]))
-            for idx in grain_list:
-                grain_entries[idx]["grain"] = audio[0, grain_entries[idx]["start_frame"]:grain_entries[idx]["end_frame"]]
-            # del audio.samples
-            del audio
+            found.append((path, starts, ends, keys))
+
+    if num_workers <= 1:
+        for path, starts, ends, keys in found:
+            store(keys, _read_grain_audio(path, starts, ends, decode_cache))
+        return
+
+    # Decoding and resampling release the GIL, so threads are enough to keep the cores busy
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        inflight = {}
+        inflight_bytes = 0
+        for path, starts, ends, keys in found:
+            job_bytes = 4 * int(np.sum(np.asarray(ends) - np.asarray(starts)))
+            while len(inflight) > 0 and (len(inflight) >= num_workers or inflight_bytes + job_bytes > max_inflight_bytes):
+                done, _ = concurrent.futures.wait(inflight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    done_keys, done_bytes = inflight.pop(future)
+                    store(done_keys, future.result())
+                    inflight_bytes -= done_bytes
+            future = executor.submit(_read_grain_audio, path, starts, ends, decode_cache)
+            inflight[future] = (keys, job_bytes)
+            inflight_bytes += job_bytes
+        for future in concurrent.futures.as_completed(list(inflight)):
+            store(inflight[future][0], future.result())
+
+
+def _read_grain_audio(path: str, starts, ends, decode_cache=None) -> list:
+    """
+    Reads the audio for the grains of one source file at 44100 Hz. With a decode cache, the grains
+    are sliced from the cached whole-file audio. Otherwise only the frame ranges that the grains
+    cover are decoded, with overlapping and adjacent ranges merged into one read.
+    :param path: The path of the audio file
+    :param starts: The start frame of each grain
+    :param ends: The end frame of each grain
+    :param decode_cache: An optional DecodeCache
+    :return: A list of grain arrays (the first channel of the source), in the order of `starts`
+    """
+    grains = [None for _ in range(len(starts))]
+    if decode_cache is not None:
+        audio = decode_cache(path)
+        for i in range(len(starts)):
+            grains[i] = audio[0, starts[i]:ends[i]]
+        return grains
+
+    spans = merge_spans(starts, ends)
+    blocks = read_spans(path, spans, 44100)
+    for span, block in zip(spans, blocks):
+        for i in span[2]:
+            grains[i] = block[0, starts[i] - span[0]:ends[i] - span[0]]
+    return grains
+
+
+class LazyGrain(dict):
+    """
+    A grain dictionary whose audio ("grain") is loaded on first access by its GrainLoader.
+    Until then, `"grain" in record` is False and `record.get("grain")` returns None.
+    """
+    def __init__(self, record: dict, loader):
+        """
+        Initializes the record
+        :param record: The grain dictionary
+        :param loader: The GrainLoader that loads the audio
+        """
+        super().__init__(record)
+        self.loader = loader
+
+    def __missing__(self, key):
+        if key != "grain":
+            raise KeyError(key)
+        self.loader.load([self])
+        if "grain" not in self:
+            raise KeyError(key)
+        return dict.__getitem__(self, key)
+
+    def copy(self):
+        return LazyGrain(self, self.loader)
+
+
+class GrainLoader:
+    """
+    Loads the audio for LazyGrain records. Loads are batched per source file, and the audio of each
+    grain id is loaded once and shared by every record (and copy of a record) with that id.
+    A grain that could not be loaded (for example, because its source file is missing) is only tried once.
+    """
+    def __init__(self, source_dir, decode_cache=None, num_workers: int = 1, max_inflight_bytes: int = 512 * 1024 ** 2, grain_store=None):
+        """
+        Initializes the loader
+        :param source_dir: The directory that contains the audio files (or a list of directories, or a SourceIndex)
+        :param decode_cache: An optional DecodeCache
+        :param num_workers: The number of source files to decode concurrently
+        :param max_inflight_bytes: The approximate limit on grain audio in flight
+        :param grain_store: An optional GrainStore
+        """
+        self.source_dir = source_dir if isinstance(source_dir, SourceIndex) else SourceIndex(source_dir)
+        self.decode_cache = decode_cache
+        self.num_workers = num_workers
+        self.max_inflight_bytes = max_inflight_bytes
+        self.grain_store = grain_store
+        self.grains = {}
+        self.failed = set()
+
+    def attach(self, grain_entries: list) -> list:
+        """
+        Replaces the grain dictionaries in a list by LazyGrain records, in place. A dictionary that
+        appears more than once in the list is replaced by the same record each time.
+        :param grain_entries: A list of grain dictionaries
+        :return: The list
+        """
+        records = {}
+        for i, grain in enumerate(grain_entries):
+            if id(grain) not in records:
+                records[id(grain)] = grain if isinstance(grain, LazyGrain) else LazyGrain(grain, self)
+            grain_entries[i] = records[id(grain)]
+        return grain_entries
+
+    def load(self, records: list):
+        """
+        Loads the audio for the records that are not loaded yet. Records whose audio could not be loaded
+        before are skipped.
+        :param records: A list of LazyGrain records from this loader
+        """
+        entries = {}
+        for record in records:
+            if "grain" not in record and record["id"] not in self.grains and record["id"] not in self.failed and record["id"] not in entries:
+                entries[record["id"]] = {field: record[field] for field in ("id", "file", "file_id", "start_frame", "end_frame")}
+        entries = list(entries.values())
+        if len(entries) > 0:
+            read_grains_from_file(entries, self.source_dir, self.decode_cache, self.num_workers, self.max_inflight_bytes, self.grain_store)
+            for entry in entries:
+                if "grain" in entry:
+                    self.grains[entry["id"]] = entry["grain"]
+                else:
+                    self.failed.add(entry["id"])
+        for record in records:
+            if "grain" not in record and record["id"] in self.grains:
+                dict.__setitem__(record, "grain", self.grains[record["id"]])
+
+
+def prefetch_grains(grains):
+    """
+    Loads the audio of every unloaded LazyGrain record in a list at once, batched per source file.
+    Merges call this before they read the grain audio.
+    :param grains: A list of grain dictionaries (other grain containers are ignored)
+    """
+    if type(grains) != list:
+        return
+    loaders = {}
+    for grain in grains:
+        if isinstance(grain, LazyGrain) and "grain" not in grain:
+            if id(grain.loader) not in loaders:
+                loaders[id(grain.loader)] = (grain.loader, [])
+            loaders[id(grain.loader)][1].append(grain)
+    for loader, records in loaders.values():
+        loader.load(records)
+
+
+def create_files_table(cursor):
+    """
+    Creates the files table if it does not exist
+    :param cursor: The cursor for executing SQL
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            sample_rate INTEGER,
+            frames INTEGER,
+            mtime REAL
+        );
+    """)
+
+
+def create_grains_table(cursor):
+    """
+    Creates the grains table and its file id index if they do not exist
+    :param cursor: The cursor for executing SQL
+    """
+    columns = []
+    for field in FIELDS:
+        if field == "id":
+            columns.append("id INTEGER PRIMARY KEY")
+        elif field == "file_id":
+            columns.append("file_id INTEGER NOT NULL REFERENCES files(id)")
+        elif field in ("start_frame", "end_frame", "length", "sample_rate"):
+            columns.append(f"{field} INTEGER")
+        elif field != "file":
+            columns.append(f"{field} REAL")
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS grains ({', '.join(columns)});")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_grains_file_id ON grains (file_id);")
+
+
+def get_file_ids(cursor, paths) -> dict:
+    """
+    Gets the file ids for a list of source file paths, adding the paths that are not in the files table yet
+    :param cursor: The cursor for executing SQL
+    :param paths: The file paths (duplicates are allowed)
+    :return: A dictionary of path -> file id
+    """
+    paths = list(dict.fromkeys(paths))
+    cursor.executemany("INSERT OR IGNORE INTO files (path) VALUES (?);", [(path,) for path in paths])
+    file_ids = {}
+    # Stay under the SQLite limit on the number of parameters in a statement
+    for i in range(0, len(paths), 500):
+        batch = paths[i:i+500]
+        cursor.execute(f"SELECT path, id FROM files WHERE path IN ({', '.join('?' for _ in batch)});", batch)
+        file_ids.update(cursor.fetchall())
+    return file_ids
+
+
+def update_file_info(db, cursor, source_dir, refresh: bool = False):
+    """
+    Fills in the sample rate, length and modification time of the source files from the audio corpus
+    :param db: A connection to a SQLite database
+    :param cursor: The cursor for executing SQL
+    :param source_dir: The directory that contains the audio files (or a list of directories, or a SourceIndex)
+    :param refresh: If True, every file is updated. Otherwise only files without a sample rate are updated.
+    """
+    if not isinstance(source_dir, SourceIndex):
+        source_dir = SourceIndex(source_dir)
+    cursor.execute("SELECT id, path FROM files" + ("" if refresh else " WHERE sample_rate IS NULL") + ";")
+    records = []
+    for file_id, database_path in cursor.fetchall():
+        path = find_path(database_path, source_dir)
+        if not os.path.exists(path):
+            print(f"Could not find path {path} for file {database_path}")
+            continue
+        with pb.io.AudioFile(path) as infile:
+            records.append((int(infile.samplerate), int(infile.frames), os.path.getmtime(path), file_id))
+    print(f"Updating {len(records)} files")
+    cursor.executemany("UPDATE files SET sample_rate = ?, frames = ?, mtime = ? WHERE id = ?;", records)
+    db.commit()
+
+
+def migrate_files_table(db, cursor, drop_file_column: bool = True):
+    """
+    Migrates a database that stores the source file path in every grain row to the files table.
+    Each distinct path is added to the files table, grains.file_id is filled in, and the old
+    grains.file column is dropped (this needs SQLite 3.35 or later; run VACUUM afterward to
+    reclaim the space). The migration can be rerun safely.
+    :param db: A connection to a SQLite database
+    :param cursor: The cursor for executing SQL
+    :param drop_file_column: Whether to drop the grains.file column
+    """
+    create_files_table(cursor)
+    cursor.execute("PRAGMA table_info(grains);")
+    columns = [row[1] for row in cursor.fetchall()]
+    if "file_id" not in columns:
+        cursor.execute("ALTER TABLE grains ADD COLUMN file_id INTEGER REFERENCES files(id);")
+    if "file" in columns:
+        cursor.execute("INSERT OR IGNORE INTO files (path) SELECT DISTINCT file FROM grains WHERE file_id IS NULL;")
+        cursor.execute("UPDATE grains SET file_id = (SELECT files.id FROM files WHERE files.path = grains.file) WHERE file_id IS NULL;")
+        print(f"Assigned file ids to {cursor.rowcount} grains")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_grains_file_id ON grains (file_id);")
+    db.commit()
+
+    if drop_file_column and "file" in columns:
+        # Indexes on the old column must be dropped before the column
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'grains' AND sql IS NOT NULL;")
+        for (name,) in cursor.fetchall():
+            cursor.execute(f"PRAGMA index_info({name});")
+            if "file" in [row[2] for row in cursor.fetchall()]:
+                cursor.execute(f"DROP INDEX {name};")
+        try:
+            cursor.execute("ALTER TABLE grains DROP COLUMN file;")
+        except sqlite3.OperationalError as e:
+            print(f"Could not drop the grains.file column: {e}")
+        db.commit()
 
 
 def store_grains(grains, db, cursor):
     """
     Stores grains in the database
-    :param grains: A list of grain dictionaries
+    :param grains: A list of grain records (see `ingest_grains`)
     :param db: A connection to a SQLite database
     :param cursor: The cursor for executing SQL
     """
-    SQL = "INSERT INTO grains VALUES(NULL, " + "?, " * 20 + "?)"
-    cursor.executemany(SQL, grains)
-    db.commit()
+    ingest_grains(db, cursor, grains, defer_indexes=False, report=False)
+
+
+def ingest_grains(db, cursor, grains, batch_size: int = 10000, defer_indexes: bool = True, report: bool = True, on_commit=None) -> dict:
+    """
+    Loads a stream of grain records into the database. Records are inserted in batches, one transaction
+    per batch, with the database in WAL mode and synchronous=NORMAL for the load (the previous journal mode
+    and synchronous setting are restored afterward). The indexes on the grains table can
+    be dropped for the load and rebuilt once at the end, which is much faster than updating them row by row.
+    :param db: A connection to a SQLite database
+    :param cursor: The cursor for executing SQL
+    :param grains: An iterable of grain records (for example, a generator). Each record is a sequence of the
+    values of `INGEST_FIELDS`, in order, or a dictionary with those keys. The file value is the source file path.
+    :param batch_size: The number of records to insert per transaction
+    :param defer_indexes: Whether to drop the grains indexes during the load and rebuild them afterward
+    :param report: Whether to print the progress after each batch
+    :param on_commit: An optional function on_commit(number of rows committed so far), called after each batch is committed
+    :return: A dictionary of load statistics (rows, seconds, rows_per_second)
+    """
+    columns = ["file_id" if field == "file" else field for field in INGEST_FIELDS]
+    file_idx = INGEST_FIELDS.index("file")
+    SQL = f"INSERT INTO grains ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)});"
+    cursor.execute("PRAGMA synchronous;")
+    synchronous = cursor.fetchone()[0]
+    cursor.execute("PRAGMA journal_mode;")
+    journal_mode = cursor.fetchone()[0]
+    cursor.execute("PRAGMA journal_mode = WAL;")
+    cursor.execute("PRAGMA synchronous = NORMAL;")
+
+    indexes = []
+    if defer_indexes:
+        cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'grains' AND sql IS NOT NULL;")
+        indexes = cursor.fetchall()
+        for name, _ in indexes:
+            cursor.execute(f"DROP INDEX {name};")
+        db.commit()
+
+    num_rows = 0
+    start = time.perf_counter()
+    grains = iter(grains)
+    try:
+        while True:
+            batch = list(itertools.islice(grains, batch_size))
+            if len(batch) == 0:
+                break
+            records = []
+            for i, grain in enumerate(batch):
+                if type(grain) == dict:
+                    missing = [field for field in INGEST_FIELDS if field not in grain]
+                    if len(missing) > 0:
+                        raise ValueError(f"Grain record {num_rows + i} is missing the fields {missing}.")
+                    grain = [grain[field] for field in INGEST_FIELDS]
+                elif len(grain) != len(INGEST_FIELDS):
+                    raise ValueError(f"Grain record {num_rows + i} has {len(grain)} values, but {len(INGEST_FIELDS)} are needed ({', '.join(INGEST_FIELDS)}).")
+                records.append(grain)
+            file_ids = get_file_ids(cursor, [record[file_idx] for record in records])
+            cursor.executemany(SQL, [tuple(record[:file_idx]) + (file_ids[record[file_idx]],) + tuple(record[file_idx+1:]) for record in records])
+            db.commit()
+            num_rows += len(records)
+            if on_commit is not None:
+                on_commit(num_rows)
+            if report:
+                seconds = time.perf_counter() - start
+                print(f"Loaded {num_rows} grains ({num_rows / seconds:.0f} rows/s)")
+    finally:
+        db.rollback()
+        if len(indexes) > 0:
+            if report:
+                print(f"Rebuilding {len(indexes)} indexes...")
+            for _, sql in indexes:
+                cursor.execute(sql)
+            db.commit()
+        cursor.execute(f"PRAGMA synchronous = {synchronous};")
+        cursor.execute(f"PRAGMA journal_mode = {journal_mode};")
+
+    seconds = time.perf_counter() - start
+    stats = {"rows": num_rows, "seconds": seconds, "rows_per_second": num_rows / seconds if seconds > 0 else 0.0}
+    if report:
+        print(f"Loaded {num_rows} grains in {seconds:.1f} s ({stats['rows_per_second']:.0f} rows/s)")
+    return stats
 
 
 def update_grain_root(cursor: sqlite3.Cursor, root_dir: str, root_dir_path: str):
     """
-    Updates the path of all grains with `root_dir` in their paths.
+    Updates the path of all source files with `root_dir` in their paths.
+    Each file is updated once, and its grains follow through their file id.
     :param root_dir: The root directory
     :param root_dir_path: The new path to this root directory
     """
-    SQL = "SELECT id, file FROM grains WHERE file LIKE ? OR file LIKE ?;"
+    SQL = "SELECT id, path FROM files WHERE path LIKE ? OR path LIKE ?;"
     cursor.execute(SQL, (f"%{root_dir}/%", f"%{root_dir}\\%"))
     records = cursor.fetchall()
     newrecords = []
@@ -128,8 +579,8 @@ def update_grain_root(cursor: sqlite3.Cursor, root_dir: str, root_dir_path: str)
         path = path.split(f"{root_dir}/")[1]
         path = os.path.join(root_dir_path, path)
         newrecords.append((path, record[0]))
-    print(f"Updating {len(records)} records")
-    SQL = "UPDATE grains SET file = ? WHERE id = ?;"
+    print(f"Updating {len(records)} files")
+    SQL = "UPDATE files SET path = ? WHERE id = ?;"
     cursor.executemany(SQL, newrecords)
 
 
@@ -0,0 +1,146 @@
+"""
+File: grain_store.py
+
+Description: Contains the GrainStore, a pre-extracted archive of grain samples that sits alongside
+the SQLite database. The store is a single memory-mappable float32 file holding the samples of every
+stored grain, plus a sidecar index (a .npy file) of grain id -> (offset, length). Grains are read
+from the store as zero-copy slices, so renders do not need to return to the source audio corpus.
+"""
+
+import numpy as np
+import os
+from . import grain_sql
+
+
+INDEX_DTYPE = np.dtype([("id", np.int64), ("offset", np.int64), ("length", np.int64)])
+
+
+class GrainStore:
+    """
+    A grain sample store. The samples are the first channel of the source audio at 44100 Hz,
+    exactly as `grain_sql.read_grains_from_file` would extract them.
+    """
+    def __init__(self, path: str):
+        """
+        Opens a grain store, or prepares a new one if it does not exist
+        :param path: The store path. The samples are stored in `path`.f32 and the index in `path`.index.npy.
+        """
+        self.path = path
+        self.samples_path = f"{path}.f32"
+        self.index_path = f"{path}.index.npy"
+        if os.path.exists(self.index_path):
+            self.index = np.load(self.index_path)
+        else:
+            self.index = np.zeros((0), dtype=INDEX_DTYPE)
+        self._map()
+
+    def _map(self):
+        """
+        Memory-maps the sample file
+        """
+        if os.path.exists(self.samples_path) and os.path.getsize(self.samples_path) > 0:
+            self.samples = np.memmap(self.samples_path, dtype=np.float32, mode="r")
+        else:
+            self.samples = np.zeros((0), dtype=np.float32)
+
+    def __len__(self):
+        return self.index.shape[0]
+
+    def __contains__(self, grain_id):
+        return bool(self.lookup([grain_id])[0][0] >= 0)
+
+    def lookup(self, ids, lengths=None) -> tuple:
+        """
+        Looks up grains in the index
+        :param ids: An array of grain ids
+        :param lengths: An optional array of expected grain lengths (end_frame - start_frame). Grains that
+        were stored with a different length (for example, after the database was re-analyzed) are treated
+        as not in the store, so they are decoded from the source audio instead.
+        :return: A tuple of arrays (offsets, lengths). Grains that are not in the store have offset -1.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self) == 0:
+            return np.full(ids.shape, -1, dtype=np.int64), np.zeros(ids.shape, dtype=np.int64)
+        pos = np.clip(np.searchsorted(self.index["id"], ids), 0, len(self) - 1)
+        found = self.index["id"][pos] == ids
+        if lengths is not None:
+            found &= self.index["length"][pos] == np.asarray(lengths, dtype=np.int64)
+        offsets = np.where(found, self.index["offset"][pos], -1)
+        lengths = np.where(found, self.index["length"][pos], 0)
+        return offsets, lengths
+
+    def grain(self, grain_id: int, length: int = None) -> np.ndarray:
+        """
+        Gets a grain's samples as a zero-copy slice of the store
+        :param grain_id: The grain id
+        :param length: The expected grain length (end_frame - start_frame). If provided, a grain stored
+        with a different length raises a KeyError.
+        :return: The grain samples
+        """
+        offsets, lengths = self.lookup([grain_id], None if length is None else [length])
+        if offsets[0] < 0:
+            raise KeyError(f"Grain {grain_id} is not in the store" + ("." if length is None else f" with length {length}."))
+        return self.samples[offsets[0]:offsets[0] + lengths[0]]
+
+    def append(self, ids: list, grains: list):
+        """
+        Appends grains to the store. Grains that are already in the store are skipped.
+        The samples are written before the index, so an interrupted append leaves the store consistent.
+        :param ids: A list of grain ids
+        :param grains: A list of grain sample arrays
+        """
+        offsets, _ = self.lookup(ids)
+        new = [i for i in range(len(ids)) if offsets[i] < 0]
+        if len(new) == 0:
+            return
+        start = os.path.getsize(self.samples_path) // 4 if os.path.exists(self.samples_path) else 0
+        entries = np.zeros((len(new)), dtype=INDEX_DTYPE)
+        with open(self.samples_path, "ab") as f:
+            for j, i in enumerate(new):
+                grain = np.asarray(grains[i], dtype=np.float32)
+                f.write(grain.tobytes())
+                entries[j] = (ids[i], start, grain.shape[-1])
+                start += grain.shape[-1]
+        index = np.concatenate((self.index, entries))
+        index = index[np.argsort(index["id"], kind="stable")]
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            np.save(f, index)
+        os.replace(temp_path, self.index_path)
+        self.index = index
+        self._map()
+
+
+def build_grain_store(cursor, source_dir, store: GrainStore, files_per_batch: int = 64, decode_cache=None, num_workers: int = 1):
+    """
+    Populates a grain store from the database and source directories. Only grains that are not
+    already in the store are extracted, so the store can be updated incrementally as the database grows.
+    :param cursor: A database cursor
+    :param source_dir: The source directory, list of directories, or SourceIndex
+    :param store: The GrainStore to populate
+    :param files_per_batch: The number of source files to extract before appending to the store
+    :param decode_cache: An optional DecodeCache
+    :param num_workers: The number of source files to decode concurrently
+    """
+    cursor.execute(f"SELECT grains.id, files.path, grains.file_id, grains.start_frame, grains.end_frame FROM grains {grain_sql.FILE_JOIN} ORDER BY grains.file_id, grains.id;")
+    records = cursor.fetchall()
+    offsets, _ = store.lookup([record[0] for record in records])
+    records = [record for i, record in enumerate(records) if offsets[i] < 0]
+    print(f"Extracting {len(records)} grains into {store.samples_path}")
+
+    if not isinstance(source_dir, grain_sql.SourceIndex):
+        source_dir = grain_sql.SourceIndex(source_dir)
+
+    # Batch the grains by source file
+    batch = []
+    num_files = 0
+    for i, record in enumerate(records):
+        batch.append({"id": record[0], "file": record[1], "file_id": record[2], "start_frame": record[3], "end_frame": record[4]})
+        if i + 1 < len(records) and records[i + 1][2] != record[2]:
+            num_files += 1
+        if i + 1 == len(records) or num_files == files_per_batch:
+            grain_sql.read_grains_from_file(batch, source_dir, decode_cache, num_workers)
+            found = [grain for grain in batch if "grain" in grain]
+            store.append([grain["id"] for grain in found], [grain["grain"] for grain in found])
+            batch = []
+            num_files = 0
@@ -0,0 +1,208 @@
+"""
+File: grain_table.py
+
+Description: Contains the GrainTable, a columnar alternative to lists of grain dictionaries.
+A GrainTable stores grain records in a NumPy structured array, with one column per database
+field plus the assembly columns (distance_between_grains, channel, start_idx, end_idx).
+Grain audio is not stored per record. Instead, each record holds an offset into a sample buffer
+that is shared by every table derived from the same source.
+"""
+
+import numpy as np
+from .grain_sql import FIELDS
+
+
+# Column types for the database fields. Fields not listed here are float64.
+# Nullable features (frequency, midi) are stored as NaN when NULL.
+FIELD_TYPES = {
+    "id": np.int64,
+    "file": object,
+    "file_id": np.int64,
+    "start_frame": np.int64,
+    "end_frame": np.int64,
+    "length": np.int64,
+    "sample_rate": np.int64,
+}
+
+# Columns that are added during assembly. sample_offset is -1 until the grain audio is loaded.
+ASSEMBLY_COLUMNS = [
+    ("distance_between_grains", np.int64),
+    ("channel", np.int64),
+    ("start_idx", np.int64),
+    ("end_idx", np.int64),
+    ("sample_offset", np.int64),
+]
+
+GRAIN_DTYPE = np.dtype([(field, FIELD_TYPES.get(field, np.float64)) for field in FIELDS] + ASSEMBLY_COLUMNS)
+
+
+class GrainTable:
+    """
+    A table of grain records backed by a NumPy structured array.
+    Columns are accessed by name (table["start_frame"]) and operated on as whole arrays.
+    Rows are accessed by index, slice or index array; a row selection returns a new table
+    that shares the sample buffer.
+    """
+    def __init__(self, data: np.ndarray, samples: np.ndarray = None):
+        """
+        Initializes the table
+        :param data: A structured array with dtype GRAIN_DTYPE
+        :param samples: The sample buffer that the sample_offset column points into
+        """
+        self.data = data
+        self.samples = samples if samples is not None else np.zeros((0), dtype=np.float32)
+
+    @classmethod
+    def empty(cls, num_grains: int):
+        """
+        Creates a table of empty grain records
+        :param num_grains: The number of records
+        :return: The table
+        """
+        data = np.zeros((num_grains), dtype=GRAIN_DTYPE)
+        data["sample_offset"] = -1
+        return cls(data)
+
+    @classmethod
+    def from_records(cls, records: list):
+        """
+        Creates a table from database records, as returned by `cursor.fetchall()`.
+        The record fields must be in the order of `grain_sql.FIELDS`.
+        :param records: A list of record tuples
+        :return: The table
+        """
+        if len(records) == 0:
+            return cls.empty(0)
+        return cls.from_columns(list(zip(*records)))
+
+    @classmethod
+    def from_columns(cls, columns: list):
+        """
+        Creates a table from database columns, for example the columns of a `fetchmany` batch
+        transposed with `zip(*rows)`. NULL values in float columns become NaN.
+        :param columns: A list of column sequences, in the order of `grain_sql.FIELDS`
+        :return: The table
+        """
+        table = cls.empty(len(columns[0]) if len(columns) > 0 else 0)
+        for i, field in enumerate(FIELDS[:len(columns)]):
+            table.data[field] = np.array(columns[i], dtype=FIELD_TYPES.get(field, np.float64))
+        return table
+
+    @classmethod
+    def from_dicts(cls, grains: list):
+        """
+        Creates a table from a list of grain dictionaries. If the dictionaries contain
+        grain audio (the "grain" key), it is copied into a new sample buffer.
+        :param grains: A list of grain dictionaries
+        :return: The table
+        """
+        table = cls.empty(len(grains))
+        for name in table.data.dtype.names:
+            if len(grains) > 0 and name in grains[0]:
+                dtype = table.data.dtype[name]
+                values = [grain[name] for grain in grains]
+                table.data[name] = np.array(values, dtype=object) if dtype == object else np.array(values, dtype=np.float64)
+        if len(grains) > 0 and "grain" in grains[0]:
+            lengths = np.array([grain["grain"].shape[-1] for grain in grains], dtype=np.int64)
+            table.data["sample_offset"] = np.cumsum(lengths) - lengths
+            table.samples = np.concatenate([grain["grain"] for grain in grains]).astype(np.float32)
+        return table
+
+    @staticmethod
+    def concatenate(tables: list):
+        """
+        Concatenates several tables. If the tables use different sample buffers,
+        the buffers are concatenated and the sample offsets are adjusted.
+        :param tables: A list of GrainTables
+        :return: The combined table
+        """
+        data = np.concatenate([table.data for table in tables])
+        if all(table.samples is tables[0].samples for table in tables):
+            return GrainTable(data, tables[0].samples)
+        start = 0
+        row = 0
+        for table in tables:
+            offsets = data["sample_offset"][row:row+len(table)]
+            offsets[offsets >= 0] += start
+            start += table.samples.shape[-1]
+            row += len(table)
+        return GrainTable(data, np.concatenate([table.samples for table in tables]))
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __getitem__(self, key):
+        """
+        Gets a column (by name), a record (by integer index), or a new table (by slice or index array)
+        :param key: The column name, index, slice or index array
+        :return: The column array, record, or table
+        """
+        if type(key) == str:
+            return self.data[key]
+        elif isinstance(key, (int, np.integer)):
+            return self.data[key]
+        else:
+            return GrainTable(self.data[key], self.samples)
+
+    def __setitem__(self, key, value):
+        """
+        Sets a column (by name) or a record (by integer index)
+        :param key: The column name or index
+        :param value: The new value(s)
+        """
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        """
+        Deletes records
+        :param key: The index, slice or index array of the records to delete
+        """
+        self.data = np.delete(self.data, key)
+
+    def take(self, indices):
+        """
+        Selects records by index. Indices may repeat.
+        :param indices: An index array
+        :return: A new table sharing this table's sample buffer
+        """
+        return GrainTable(self.data[np.asarray(indices, dtype=np.int64)], self.samples)
+
+    def copy(self):
+        """
+        Copies the records. The sample buffer is shared.
+        :return: A new table
+        """
+        return GrainTable(self.data.copy(), self.samples)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """
+        The length of each grain, in frames
+        """
+        return self.data["end_frame"] - self.data["start_frame"]
+
+    def grain(self, idx: int) -> np.ndarray:
+        """
+        Gets the audio of a grain, as a view of the sample buffer
+        :param idx: The record index
+        :return: The grain audio
+        """
+        offset = self.data["sample_offset"][idx]
+        if offset < 0:
+            raise ValueError(f"The audio for grain {idx} has not been loaded.")
+        return self.samples[offset:offset + self.data["end_frame"][idx] - self.data["start_frame"][idx]]
+
+    def to_dicts(self) -> list:
+        """
+        Converts the table to a list of grain dictionaries.
+        Grain audio is included (as views of the sample buffer) if it has been loaded.
+        :return: A list of grain dictionaries
+        """
+        names = self.data.dtype.names
+        grains = []
+        for i in range(len(self)):
+            grain = {name: self.data[name][i].item() if self.data.dtype[name] != object else self.data[name][i] for name in names if name != "sample_offset"}
+            if self.data["sample_offset"][i] >= 0:
+                grain["grain"] = self.grain(i)
+            grains.append(grain)
+        return grains
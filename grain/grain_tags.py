@@ -0,0 +1,101 @@
+"""
+File: grain_tags.py
+
+Description: Contains the grain tagger. Grains are tagged by keywords in their source file paths.
+Tagging is set-based and incremental: each distinct source file is matched against the keywords once,
+the file tags are expanded to the grains of each file with a single INSERT ... SELECT, a UNIQUE
+(grain_id, tag) index makes duplicate tags impossible, and the last tagged grain id is recorded so
+that later runs only tag new grains. Code that deletes grains must call `rewind_tag_state` first,
+since SQLite reuses the ids of grains deleted from the end of the table.
+"""
+
+
+def prepare_tag_schema(db, cursor):
+    """
+    Prepares the database for tagging. Existing duplicate tags are removed once, before the
+    UNIQUE (grain_id, tag) index is created.
+    :param db: A connection to a SQLite database
+    :param cursor: The cursor for executing SQL
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_tags_grain_id_tag';")
+    if cursor.fetchone() is None:
+        print("Removing duplicate tags...")
+        cursor.execute("DELETE FROM tags WHERE rowid NOT IN (SELECT MIN(rowid) FROM tags GROUP BY grain_id, tag);")
+        cursor.execute("CREATE UNIQUE INDEX idx_tags_grain_id_tag ON tags (grain_id, tag);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_grains_file_id ON grains (file_id);")
+    cursor.execute("CREATE TABLE IF NOT EXISTS tag_state (name TEXT PRIMARY KEY, value INTEGER NOT NULL);")
+    db.commit()
+
+
+def rewind_tag_state(cursor, grain_id: int):
+    """
+    Lowers the last tagged grain id below a grain id, so that the grains with that id or higher are
+    tagged on the next run. Grains that keep their tags are not tagged twice, because of the UNIQUE index.
+    :param cursor: The cursor for executing SQL
+    :param grain_id: The lowest grain id that should be tagged again
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tag_state';")
+    if cursor.fetchone() is not None:
+        cursor.execute("UPDATE tag_state SET value = ? WHERE name = 'last_grain_id' AND value >= ?;", (grain_id - 1, grain_id))
+
+
+def match_tags(path: str, keywords: dict) -> set:
+    """
+    Finds the tags for a source file path
+    :param path: The file path
+    :param keywords: A dictionary of keyword -> list of tags. If the lowercase path contains a keyword, its tags apply.
+    :return: The set of tags
+    """
+    path = path.lower()
+    tags = set()
+    for keyword, keyword_tags in keywords.items():
+        if keyword in path:
+            tags.update(keyword_tags)
+    return tags
+
+
+def tag_grains(db, cursor, keywords: dict, rebuild: bool = False) -> int:
+    """
+    Tags the grains that were added since the last run
+    :param db: A connection to a SQLite database
+    :param cursor: The cursor for executing SQL
+    :param keywords: A dictionary of keyword -> list of tags. If the lowercase file path contains a keyword,
+    its tags apply to every grain from that file.
+    :param rebuild: If True, all grains are tagged again (existing tags are kept)
+    :return: The number of tags added
+    """
+    prepare_tag_schema(db, cursor)
+    cursor.execute("SELECT value FROM tag_state WHERE name = 'last_grain_id';")
+    row = cursor.fetchone()
+    last_id = 0 if row is None or rebuild else row[0]
+    cursor.execute("SELECT MAX(id) FROM grains;")
+    max_id = cursor.fetchone()[0]
+    if max_id is None or max_id <= last_id:
+        print("No new grains to tag")
+        return 0
+
+    # Match each distinct file once
+    cursor.execute("SELECT id, path FROM files WHERE id IN (SELECT DISTINCT file_id FROM grains WHERE id > ? AND id <= ?);", (last_id, max_id))
+    file_tags = []
+    files = cursor.fetchall()
+    for file_id, path in files:
+        for tag in sorted(match_tags(path, keywords)):
+            file_tags.append((file_id, tag))
+    print(f"Matched {len(files)} files to {len(file_tags)} file tags")
+
+    # Expand the file tags to the grains of each file
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS file_tags (file_id INTEGER NOT NULL, tag TEXT NOT NULL);")
+    cursor.execute("DELETE FROM file_tags;")
+    cursor.executemany("INSERT INTO file_tags (file_id, tag) VALUES (?, ?);", file_tags)
+    cursor.execute("""
+        INSERT OR IGNORE INTO tags (grain_id, tag)
+        SELECT grains.id, file_tags.tag FROM file_tags
+        INNER JOIN grains ON grains.file_id = file_tags.file_id
+        WHERE grains.id > ? AND grains.id <= ?;
+    """, (last_id, max_id))
+    num_added = cursor.rowcount
+    cursor.execute("DROP TABLE file_tags;")
+    cursor.execute("INSERT OR REPLACE INTO tag_state (name, value) VALUES ('last_grain_id', ?);", (max_id,))
+    db.commit()
+    print(f"Added {num_added} tags")
+    return num_added
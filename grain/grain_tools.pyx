@@ -8,23 +8,26 @@ This file is for granulation tools. You need to build it before using it:
 import numpy as np
 
 
-def crossfade(audio1: np.ndarray, audio2: np.ndarray, double merge_fraction):
+def crossfade(audio1: np.ndarray, audio2: np.ndarray, double merge_fraction, sin_arr=None, cos_arr=None):
     """
-    Crossfades two audio arrays
+    Crossfades two audio arrays. The result has the dtype of audio1.
     :param audio1: An audio array
     :param audio2: An audio array
     :param merge_fraction: The percentage of overlap for merging. The smallest audio array will be chosen for calculating this percentage.
+    :param sin_arr: An optional precomputed fade-in curve of the overlap length
+    :param cos_arr: An optional precomputed fade-out curve of the overlap length
     :return: The merged audio
     """
     cdef int i
     cdef int j
     cdef int start_idx
     overlap_len = int(min(audio1.shape[-1], audio2.shape[-1]) * merge_fraction)
-    x = np.linspace(0, np.pi / 2, overlap_len, False)
-    sin_arr = np.sin(x)
-    cos_arr = np.cos(x)
+    if sin_arr is None or cos_arr is None:
+        x = np.linspace(0, np.pi / 2, overlap_len, False)
+        sin_arr = np.sin(x).astype(audio1.dtype, copy=False)
+        cos_arr = np.cos(x).astype(audio1.dtype, copy=False)
     if audio1.ndim == 2:
-        new_audio = np.hstack((audio1, np.zeros((audio1.shape[0], audio2.shape[-1] - overlap_len))))
+        new_audio = np.hstack((audio1, np.zeros((audio1.shape[0], audio2.shape[-1] - overlap_len), dtype=audio1.dtype)))
         start_idx = audio1.shape[-1] - overlap_len
         for i in range(audio1.shape[0]):
             for j in range(0, overlap_len):
@@ -32,7 +35,7 @@ def crossfade(audio1: np.ndarray, audio2: np.ndarray, double merge_fraction):
             for j in range(overlap_len, audio2.shape[-1]):
                 new_audio[i, j + start_idx] = audio2[i, j]
     elif audio1.ndim == 1:
-        new_audio = np.hstack((audio1, np.zeros((audio2.shape[-1] - overlap_len))))
+        new_audio = np.hstack((audio1, np.zeros((audio2.shape[-1] - overlap_len), dtype=audio1.dtype)))
         start_idx = audio1.shape[-1] - overlap_len
         for j in range(0, overlap_len):
             new_audio[j + start_idx] = new_audio[j + start_idx] * cos_arr[j] + audio2[j] * sin_arr[j]
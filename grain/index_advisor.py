@@ -0,0 +1,91 @@
+"""
+File: index_advisor.py
+
+Description: Contains schema maintenance tools for the grains and tags tables. Indexes are
+recommended from the GrainQuery category specs, created, and checked with EXPLAIN QUERY PLAN.
+"""
+
+from .grain_query import build_sql
+
+# The tags index serves the `grains.id IN (SELECT grain_id FROM tags WHERE tag IN (...))` filter
+# without touching the tags table itself
+TAGS_INDEX = ("idx_tags_tag_grain_id", "tags", ["tag", "grain_id"])
+
+# Grain features that are NULL for unpitched grains
+NULLABLE_FIELDS = ["frequency", "midi"]
+
+
+def recommend_indexes(queries: list) -> list:
+    """
+    Recommends indexes for a list of category queries. Each distinct query shape gets a composite
+    index on the grains table with length first, then the nullable columns (tested with IS NULL or
+    a range), then the other range columns, then energy. SQLite can seek on the leading columns and
+    filter the rest from the index without reading the table rows. Putting the nullable columns
+    first lets pitched and unpitched categories share the same leading columns, and an index is
+    dropped if another index has the same seek columns and contains all of its columns.
+    :param queries: A list of GrainQuery objects
+    :return: A list of tuples (index name, table name, column list)
+    """
+    shapes = []
+    for query in queries:
+        nullable = [field for field in NULLABLE_FIELDS if field in query.null_fields or field in query.ranges]
+        columns = ["length"] + nullable + [field for field in query.ranges if field not in nullable]
+        if query.min_energy is not None:
+            columns.append("energy")
+        # SQLite seeks on the equality columns and the first range column
+        seek = columns[:len(nullable) + 2]
+        if (columns, seek) not in shapes:
+            shapes.append((columns, seek))
+
+    indexes = [TAGS_INDEX]
+    for i, (columns, seek) in enumerate(shapes):
+        redundant = False
+        for j, (other, other_seek) in enumerate(shapes):
+            if other_seek == seek and (set(columns) < set(other) or (set(columns) == set(other) and j < i)):
+                redundant = True
+        if not redundant:
+            indexes.append((f"idx_grains_{'_'.join(columns)}", "grains", columns))
+    return indexes
+
+
+def create_indexes(db, cursor, indexes: list):
+    """
+    Creates indexes (if they do not exist) and updates the query planner statistics
+    :param db: A connection to a SQLite database
+    :param cursor: The cursor for executing SQL
+    :param indexes: A list of tuples (index name, table name, column list)
+    """
+    for name, table, columns in indexes:
+        print(f"Creating index {name}")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)});")
+    cursor.execute("ANALYZE;")
+    db.commit()
+
+
+def explain(cursor, length: int, queries: list) -> list:
+    """
+    Gets the query plan for each category query
+    :param cursor: A database cursor
+    :param length: The target grain length
+    :param queries: A list of GrainQuery objects
+    :return: A list of query plans, one per query. Each plan is a list of plan detail strings.
+    """
+    plans = []
+    for query in queries:
+        sql, params = build_sql(length, [query])
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        plans.append([row[-1] for row in cursor.fetchall()])
+    return plans
+
+
+def report(cursor, length: int, queries: list):
+    """
+    Prints the query plan for each category query, so you can confirm that the indexes are used
+    :param cursor: A database cursor
+    :param length: The target grain length
+    :param queries: A list of GrainQuery objects
+    """
+    for i, plan in enumerate(explain(cursor, length, queries)):
+        print(f"Query {i}:")
+        for detail in plan:
+            print(f"    {detail}")
@@ -0,0 +1,180 @@
+"""
+File: scheduler.py
+
+Description: Contains a batch render scheduler. A list of render jobs is run on a bounded
+process pool; each job reports its duration and peak memory, a job that fails does not stop
+the rest of the batch, and jobs lost to a crashed worker process are rerun in isolation.
+"""
+
+import concurrent.futures
+import numpy as np
+import os
+import time
+import tracemalloc
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import resource
+except ImportError:
+    # The resource module is not available on Windows
+    resource = None
+
+
+class RenderJob:
+    """
+    The configuration for one render
+    """
+    def __init__(self, query: str, num_repetitions: list, grain_overlap_num: int, num_channels: int, name: str,
+                 seed: int = None, num_unique_grains: int = 10, block_size: int = None, dtype=np.float64):
+        """
+        Initializes the render job
+        :param query: The key of the grain categories to render from (see `run_jobs`)
+        :param num_repetitions: The number of repetitions for each category
+        :param grain_overlap_num: The distance between grains, in frames. If negative, grains will overlap.
+        :param num_channels: The number of channels in the output audio file
+        :param name: The output file name
+        :param seed: The random seed. If None, the render is seeded from the system.
+        :param num_unique_grains: The number of unique grains to use for each category
+        :param block_size: If provided, the render is streamed in blocks of this many frames
+        :param dtype: The dtype of the render buffers (np.float64 or np.float32)
+        """
+        self.query = query
+        self.num_repetitions = num_repetitions
+        self.grain_overlap_num = grain_overlap_num
+        self.num_channels = num_channels
+        self.name = name
+        self.seed = seed
+        self.num_unique_grains = num_unique_grains
+        self.block_size = block_size
+        self.dtype = dtype
+
+
+def _run_job(render_fn, categories, job: RenderJob, source_dirs, out_dir: str, trace_memory: bool) -> dict:
+    """
+    Runs a render job in a worker process
+    :param render_fn: The render function
+    :param categories: The grain categories for the job
+    :param job: The RenderJob
+    :param source_dirs: The location(s) of the audio files
+    :param out_dir: The output directory
+    :param trace_memory: Whether to trace the peak Python and NumPy memory of the job
+    :return: A dictionary of job statistics
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        render_fn(categories, job.num_unique_grains, job.num_repetitions, job.grain_overlap_num, job.num_channels,
+                  source_dirs, out_dir, job.name, job.seed, job.block_size, job.dtype)
+    finally:
+        seconds = time.perf_counter() - start
+        peak_memory = None
+        if trace_memory:
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    stats = {"name": job.name, "path": os.path.join(out_dir, job.name), "seconds": seconds, "peak_memory": peak_memory, "max_rss": None}
+    if resource is not None:
+        # The peak resident set size of the worker process so far (kilobytes on Linux, bytes on macOS)
+        stats["max_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return stats
+
+
+def run_jobs(render_fn, jobs: list, categories: dict, source_dirs, out_dir: str, max_workers: int = None,
+             max_retries: int = 1, trace_memory: bool = False) -> list:
+    """
+    Runs a batch of render jobs on a process pool. If a worker process crashes, the pool breaks and
+    every unfinished job on it is lost. The lost jobs are then rerun in isolation, each in its own
+    single-process pool, so a job that crashes its worker again fails alone.
+    :param render_fn: The render function, with the signature of `render_interpolator.render`.
+    It must be importable by the worker processes (a module-level function).
+    :param jobs: A list of RenderJobs
+    :param categories: A dictionary of query key -> grain categories (for example, a SharedGrainPool)
+    :param source_dirs: The location(s) of the audio files
+    :param out_dir: The output directory
+    :param max_workers: The maximum number of worker processes. Defaults to the number of cores.
+    :param max_retries: The number of times a job is retried in isolation after its worker process crashes
+    :param trace_memory: Whether to trace the peak Python and NumPy memory of each job with tracemalloc.
+    This slows rendering down considerably; the peak resident set size is always reported where available.
+    :return: A list of job statistic dictionaries, in job order. A failed job has an "error" entry.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    max_workers = max(1, min(max_workers, len(jobs)))
+    results = [None for _ in range(len(jobs))]
+    attempts = [0 for _ in range(len(jobs))]
+    num_done = 0
+
+    def finish(i, stats):
+        nonlocal num_done
+        stats["attempts"] = attempts[i]
+        results[i] = stats
+        num_done += 1
+        _report(stats, num_done, len(jobs))
+
+    # Run every job on a shared pool
+    lost = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for i in range(len(jobs)):
+            futures[executor.submit(_run_job, render_fn, categories[jobs[i].query], jobs[i], source_dirs, out_dir, trace_memory)] = i
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            try:
+                stats = future.result()
+            except BrokenProcessPool:
+                # There is no telling which lost job crashed the pool, or whether a job had started at all
+                lost.append(i)
+                continue
+            except Exception as e:
+                stats = {"name": jobs[i].name, "error": repr(e)}
+            attempts[i] += 1
+            finish(i, stats)
+
+    # Rerun the lost jobs in isolation
+    if len(lost) > 0:
+        print(f"Rerunning {len(lost)} jobs in isolation after a worker process crashed")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(_run_isolated, render_fn, categories[jobs[i].query], jobs[i], source_dirs, out_dir,
+                                       trace_memory, max_retries): i for i in sorted(lost)}
+            for future in concurrent.futures.as_completed(futures):
+                i = futures[future]
+                stats, attempts[i] = future.result()
+                finish(i, stats)
+    return results
+
+
+def _run_isolated(render_fn, categories, job: RenderJob, source_dirs, out_dir: str, trace_memory: bool, max_retries: int) -> tuple:
+    """
+    Runs a render job in its own single-process pool, retrying it if the worker process crashes
+    :param render_fn: The render function
+    :param categories: The grain categories for the job
+    :param job: The RenderJob
+    :param source_dirs: The location(s) of the audio files
+    :param out_dir: The output directory
+    :param trace_memory: Whether to trace the peak Python and NumPy memory of the job
+    :param max_retries: The number of times the job is retried after its worker process crashes
+    :return: A tuple (job statistics, number of attempts)
+    """
+    for attempt in range(1, max_retries + 2):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+            try:
+                return executor.submit(_run_job, render_fn, categories, job, source_dirs, out_dir, trace_memory).result(), attempt
+            except BrokenProcessPool:
+                continue
+            except Exception as e:
+                return {"name": job.name, "error": repr(e)}, attempt
+    return {"name": job.name, "error": "The worker process crashed."}, max_retries + 1
+
+
+def _report(stats: dict, num_done: int, num_jobs: int):
+    """
+    Prints the progress of a batch
+    :param stats: The statistics of the job that just finished
+    :param num_done: The number of finished jobs
+    :param num_jobs: The total number of jobs
+    """
+    if "error" in stats:
+        print(f"[{num_done}/{num_jobs}] {stats['name']} failed: {stats['error']}")
+    else:
+        peak = f", peak memory {stats['peak_memory'] / 1024 ** 2:.0f} MB" if stats["peak_memory"] is not None else ""
+        print(f"[{num_done}/{num_jobs}] {stats['name']} finished in {stats['seconds']:.1f} s{peak}")
@@ -0,0 +1,126 @@
+"""
+File: source_index.py
+
+Description: Contains the SourceIndex, which resolves database file paths to paths on this machine.
+The source directories are walked once to build a dictionary of file names, and the dictionary
+can be persisted to a cache file that is reused for as long as the directory modification times match.
+"""
+
+import json
+import os
+
+
+def database_basename(database_path: str) -> str:
+    """
+    Gets the file name from a database path. This compensates for os.path.split()
+    not working properly on paths from other platforms.
+    :param database_path: The path of the file in the database
+    :return: The file name
+    """
+    idx = len(database_path) - 1
+    while idx >= 0:
+        if database_path[idx] == "\\" or database_path[idx] == "/":
+            break
+        idx -= 1
+    return database_path[idx+1:]
+
+
+class SourceIndex:
+    """
+    An index of the audio files under one or more source directories, keyed by file name.
+    File names must match exactly, including extension and case. If a file name occurs
+    more than once, lookups for it are reported as ambiguous instead of picking one of the files.
+    """
+    def __init__(self, source_dirs, cache_path: str = None):
+        """
+        Initializes the index. If a valid cache file exists, it is loaded; otherwise the source
+        directories are walked and the cache file (if provided) is written.
+        :param source_dirs: A source directory or list of source directories
+        :param cache_path: An optional path for the cache file
+        """
+        self.source_dirs = [source_dirs] if type(source_dirs) == str else list(source_dirs)
+        self.cache_path = cache_path
+        self.files = {}
+        self.dir_mtimes = {}
+        self._reported = set()
+        if cache_path is None or not self._load():
+            self.build()
+            if cache_path is not None:
+                self.save()
+
+    def build(self):
+        """
+        Walks the source directories and rebuilds the index
+        """
+        self.files = {}
+        self.dir_mtimes = {}
+        for source_dir in self.source_dirs:
+            for path, _, files in os.walk(source_dir):
+                self.dir_mtimes[path] = os.stat(path).st_mtime_ns
+                for file in files:
+                    if file not in self.files:
+                        self.files[file] = []
+                    self.files[file].append(os.path.join(path, file))
+
+    def save(self):
+        """
+        Writes the index to its cache file
+        """
+        cache_dir = os.path.dirname(self.cache_path)
+        if cache_dir != "":
+            os.makedirs(cache_dir, exist_ok=True)
+        temp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"source_dirs": self.source_dirs, "dir_mtimes": self.dir_mtimes, "files": self.files}, f)
+        os.replace(temp_path, self.cache_path)
+
+    def _load(self) -> bool:
+        """
+        Loads the index from its cache file, if the cache is still valid. The cache is valid
+        if it was built for the same source directories and no directory has been modified since.
+        A missing, unreadable or malformed cache file is a cache miss. The file is opened directly
+        rather than checked first, since another process can replace or remove it in between.
+        :return: Whether or not the cache was loaded
+        """
+        try:
+            with open(self.cache_path, "r") as f:
+                cache = json.load(f)
+            if cache["source_dirs"] != self.source_dirs:
+                return False
+            dir_mtimes = cache["dir_mtimes"]
+            files = cache["files"]
+            for path, mtime in dir_mtimes.items():
+                if os.stat(path).st_mtime_ns != mtime:
+                    return False
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            # FileNotFoundError is an OSError, and json.JSONDecodeError is a ValueError
+            return False
+        self.dir_mtimes = dir_mtimes
+        self.files = files
+        return True
+
+    def ambiguous(self) -> dict:
+        """
+        Gets the file names that occur more than once under the source directories
+        :return: A dictionary of file name -> list of paths
+        """
+        return {file: paths for file, paths in self.files.items() if len(paths) > 1}
+
+    def resolve(self, database_path: str) -> str:
+        """
+        Resolves a database path to a path on this machine
+        :param database_path: The path of the file in the database
+        :return: The actual file path on this machine, or an empty string if the file
+        was not found or its name is ambiguous
+        """
+        file = database_basename(database_path)
+        paths = self.files.get(file, [])
+        if len(paths) == 1:
+            return paths[0]
+        elif len(paths) > 1:
+            if file not in self._reported:
+                self._reported.add(file)
+                print(f"The file name {file} is ambiguous. It matches {len(paths)} files:")
+                for path in paths:
+                    print(f"    {path}")
+        return ""
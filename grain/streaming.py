@@ -0,0 +1,176 @@
+"""
+File: streaming.py
+
+Description: Contains a streaming render path for long renders. Merged audio arrives in blocks
+(see `grain_assembler.merge_blocks`) and is spooled to a temporary memory-mapped file. The post-chain
+(equal-energy leveling, filters, fades and an optional output level) then runs over the file block by block, with
+the filter state carried from block to block, and the finished blocks are written to the output file.
+Peak memory depends on the block size rather than the length of the render, but the temporary file
+holds the whole merged timeline (see `render_blocks`).
+"""
+
+import numpy as np
+import os
+import pedalboard as pb
+import scipy.signal as signal
+import shutil
+import tempfile
+from .windows import get_window
+
+
+def render_blocks(blocks, num_frames: int, num_channels: int, path: str, sample_rate: int = 44100, bits_per_sample: int = 24,
+                  equal_energy_dbfs: float = -3.0, equal_energy_window: int = 22000, filters: list = None,
+                  fade_duration: int = 0, window_fn=np.hanning, silence: int = 0, block_size: int = 65536,
+                  temp_dir: str = None, max_scalar: float = 1e6, dtype=np.float64, output_dbfs: float = None):
+    """
+    Runs the render post-chain over a stream of merged audio blocks and writes the output file.
+    The result matches `aus.operations.force_equal_energy`, then `scipy.signal.sosfilt` for each filter,
+    then `windows.fade_in` and `windows.fade_out`, then scaling to the output peak level, applied to the
+    whole merged array.
+
+    Disk cost: the whole merged timeline is spooled to a temporary file of num_channels * num_frames
+    * dtype itemsize bytes (about 1.27 GB per channel-hour at 44.1 kHz in float64, half that in float32).
+    The file is written once and read three times, and if output_dbfs is set it is rewritten and read
+    once more. A ValueError is raised before anything is spooled if temp_dir does not have enough free space.
+    :param blocks: An iterable of tuples (block start frame, block), with blocks of shape (num_channels, frames)
+    that together cover [0, num_frames) in order
+    :param num_frames: The length of the merged audio, in frames
+    :param num_channels: The number of channels
+    :param path: The output file path
+    :param sample_rate: The output sample rate
+    :param bits_per_sample: The output bit depth
+    :param equal_energy_dbfs: The target level for equal-energy leveling, in dBFS. If None, leveling is skipped.
+    :param equal_energy_window: The RMS window size for equal-energy leveling
+    :param filters: A list of filters in second-order sections format (for example, from `scipy.signal.butter`)
+    :param fade_duration: The fade-in and fade-out duration, in frames
+    :param window_fn: The window function for the fades
+    :param silence: The number of frames of silence to add at the end
+    :param block_size: The block length for the post-chain passes, in frames
+    :param temp_dir: The directory for the temporary file. If None, the system temporary directory is used.
+    :param max_scalar: The maximum scalar for equal-energy leveling (see `aus.operations.force_equal_energy`)
+    :param dtype: The dtype of the temporary file. np.float32 halves its size and disk traffic. The post-chain
+    itself runs on float64 blocks, since high-order IIR filters lose precision in float32.
+    :param output_dbfs: An optional peak level for the output, in dBFS. This is opt-in: the default (None)
+    leaves the level unchanged, which matches the in-memory render, since `aus.operations.adjust_level`
+    currently returns its input unchanged. Setting it changes the output level and costs an extra pass
+    over the temporary file.
+    """
+    filters = filters if filters is not None else []
+    spool_bytes = num_channels * num_frames * np.dtype(dtype).itemsize
+    free_bytes = shutil.disk_usage(temp_dir if temp_dir is not None else tempfile.gettempdir()).free
+    if spool_bytes > free_bytes:
+        raise ValueError(f"The streaming render needs {spool_bytes} bytes of temporary space, but only {free_bytes} bytes are free. Set temp_dir to a larger disk.")
+
+    with tempfile.TemporaryDirectory(dir=temp_dir) as spool_dir:
+        # Pass 1: spool the merged audio
+        audio = np.lib.format.open_memmap(os.path.join(spool_dir, "merged.npy"), mode="w+", dtype=dtype, shape=(num_channels, num_frames))
+        for block_start, block in blocks:
+            audio[:, block_start:block_start + block.shape[-1]] = block
+
+        # Passes 2 and 3: measure the window energy and the peak level after leveling
+        scalar = 1.0
+        energy = None
+        if equal_energy_dbfs is not None and num_frames > 0:
+            energy = _window_energy(audio, equal_energy_window)
+            peak = 0.0
+            for start in range(0, num_frames, block_size):
+                end = min(start + block_size, num_frames)
+                peak = max(peak, np.max(np.abs(audio[:, start:end] * _equal_energy_scalars(energy, start, end, num_frames, equal_energy_window, max_scalar))))
+            scalar = 10 ** (equal_energy_dbfs / 20) / peak
+            scalar = min(max(scalar, 1 / max_scalar), max_scalar)
+
+        # Pass 4: level, filter and fade. If the output level is set, the finished blocks go back into
+        # the temporary file (each block is read before it is overwritten) until the output peak is known.
+        fade = min(fade_duration, num_frames)
+        fade_window = get_window(window_fn, fade * 2)
+        zi = [np.zeros((sos.shape[0], num_channels, 2)) for sos in filters]
+        output_peak = 0.0
+        with pb.io.AudioFile(path, "w", sample_rate, num_channels, bits_per_sample) as outfile:
+            for start in range(0, num_frames, block_size):
+                end = min(start + block_size, num_frames)
+                block = np.array(audio[:, start:end], dtype=np.float64)
+                if energy is not None:
+                    block = block * _equal_energy_scalars(energy, start, end, num_frames, equal_energy_window, max_scalar) * scalar
+                for i, sos in enumerate(filters):
+                    block, zi[i] = signal.sosfilt(sos, block, zi=zi[i])
+                if start < fade:
+                    block[:, :fade - start] *= fade_window[start:min(end, fade)]
+                if end > num_frames - fade:
+                    low = max(start, num_frames - fade)
+                    block[:, low - start:] *= fade_window[fade + low - (num_frames - fade):fade + end - (num_frames - fade)]
+                if output_dbfs is None:
+                    outfile.write(block)
+                else:
+                    output_peak = max(output_peak, np.max(np.abs(block)))
+                    audio[:, start:end] = block
+
+            # Pass 5: scale to the output level and write
+            if output_dbfs is not None:
+                output_scalar = _level_scalar(output_peak, output_dbfs)
+                for start in range(0, num_frames, block_size):
+                    end = min(start + block_size, num_frames)
+                    outfile.write(np.nan_to_num(np.array(audio[:, start:end], dtype=np.float64) * output_scalar))
+            for start in range(0, silence, block_size):
+                outfile.write(np.zeros((num_channels, min(block_size, silence - start))))
+        del audio
+
+
+def _level_scalar(peak: float, max_level: float, max_scalar: float = 1e10) -> float:
+    """
+    Calculates the scalar that brings audio with a given peak to a dB level
+    :param peak: The peak absolute sample value
+    :param max_level: The max level for the audio, in dBFS
+    :param max_scalar: The maximum scalar to use
+    :return: The scalar
+    """
+    if peak == 0:
+        return max_scalar
+    return min(max(10 ** (max_level / 20) / peak, 1 / max_scalar), max_scalar)
+
+
+def _window_energy(audio: np.ndarray, window_size: int) -> np.ndarray:
+    """
+    Measures the RMS energy of each window of each channel, as `aus.operations.force_equal_energy` does.
+    The first and last windows are repeated at the edges.
+    :param audio: The audio, with shape (num_channels, frames)
+    :param window_size: The window size
+    :return: The energy levels, with shape (num_channels, number of windows + 2)
+    """
+    num_windows = int(np.ceil(audio.shape[-1] / window_size))
+    energy = np.empty((audio.shape[0], num_windows + 2))
+    for i in range(audio.shape[0]):
+        for j in range(num_windows):
+            window = audio[i, j * window_size:min((j + 1) * window_size, audio.shape[-1])]
+            energy[i, j + 1] = np.sqrt(np.average(np.square(window.astype(np.float64, copy=False))))
+    energy[:, 0] = energy[:, 1]
+    energy[:, -1] = energy[:, -2]
+    return energy
+
+
+def _equal_energy_scalars(energy: np.ndarray, start: int, end: int, num_frames: int, window_size: int, max_scalar: float) -> np.ndarray:
+    """
+    Computes the equal-energy leveling scalars for a range of frames. The energy is interpolated
+    linearly between the centers of adjacent windows, as in `aus.operations.force_equal_energy`.
+    :param energy: The energy levels from `_window_energy`
+    :param start: The first frame
+    :param end: The frame after the last frame
+    :param num_frames: The length of the audio
+    :param window_size: The window size
+    :param max_scalar: The maximum scalar
+    :return: The scalars, with shape (num_channels, end - start)
+    """
+    half = window_size // 2
+    frames = np.arange(start, end)
+    scalars = np.empty((energy.shape[0], end - start))
+    with np.errstate(divide="ignore"):
+        # The first half window uses the first window's level
+        head = frames < half
+        scalars[:, head] = 1 / energy[:, :1]
+        # Every later frame lies between the centers of windows k and k + 1
+        tail = frames[~head]
+        k = (tail - half) // window_size
+        frame_start = half + k * window_size
+        frame_size = np.minimum(frame_start + window_size, num_frames) - frame_start
+        slope = (energy[:, k + 2] - energy[:, k + 1]) / frame_size
+        scalars[:, ~head] = 1 / (slope * (tail - frame_start) + energy[:, k + 1])
+    return np.clip(scalars, 1 / max_scalar, max_scalar)
@@ -0,0 +1,121 @@
+"""
+File: windows.py
+
+Description: Contains a bounded LRU cache for window functions. A render usually uses only one
+or two grain lengths, so the windows for merging and crossfading can be computed once and shared.
+"""
+
+import numpy as np
+from collections import OrderedDict
+
+
+class WindowBank:
+    """
+    A bounded LRU cache of windows, keyed by (window_fn, length, dtype).
+    Cached windows are read-only, so they can be safely shared between callers.
+    """
+    def __init__(self, max_size: int = 32):
+        """
+        Initializes the window bank
+        :param max_size: The maximum number of windows to keep
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._windows = OrderedDict()
+
+    def __call__(self, window_fn, length: int, dtype=np.float64) -> np.ndarray:
+        """
+        Gets a window, computing it if it is not in the cache
+        :param window_fn: The window function (for example np.hanning)
+        :param length: The window length
+        :param dtype: The window dtype. The window is computed in float64 and then converted.
+        :return: A read-only window array
+        """
+        key = (window_fn, int(length), np.dtype(dtype))
+        window = self._windows.get(key)
+        if window is not None:
+            self.hits += 1
+            self._windows.move_to_end(key)
+            return window
+        self.misses += 1
+        # Copy before freezing, so the array that the window function returned (which it may keep) stays writable
+        window = np.array(window_fn(int(length)), dtype=dtype)
+        window.setflags(write=False)
+        self._windows[key] = window
+        if len(self._windows) > self.max_size:
+            self._windows.popitem(last=False)
+        return window
+
+    def __len__(self):
+        return len(self._windows)
+
+    def clear(self):
+        """
+        Empties the cache and resets the hit/miss counters
+        """
+        self._windows.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+def sine_fade(length: int) -> np.ndarray:
+    """
+    A quarter-sine fade-in curve, as used for equal-power crossfades
+    :param length: The fade length
+    :return: The fade curve
+    """
+    return np.sin(np.linspace(0, np.pi / 2, length, False))
+
+
+def cosine_fade(length: int) -> np.ndarray:
+    """
+    A quarter-cosine fade-out curve, as used for equal-power crossfades
+    :param length: The fade length
+    :return: The fade curve
+    """
+    return np.cos(np.linspace(0, np.pi / 2, length, False))
+
+
+def fade_in(audio: np.ndarray, duration: int, window_fn=np.hanning) -> np.ndarray:
+    """
+    Applies a fade-in using the first half of a cached window. Matches `aus.operations.fade_in`.
+    :param audio: The audio (may have multiple channels)
+    :param duration: The fade duration in frames. It is truncated to the audio length.
+    :param window_fn: The window function
+    :return: The faded audio
+    """
+    duration = min(duration, audio.shape[-1])
+    audio = audio.copy()
+    audio[..., :duration] *= get_window(window_fn, duration * 2)[:duration]
+    return audio
+
+
+def fade_out(audio: np.ndarray, duration: int, window_fn=np.hanning) -> np.ndarray:
+    """
+    Applies a fade-out using the second half of a cached window. Matches `aus.operations.fade_out`.
+    :param audio: The audio (may have multiple channels)
+    :param duration: The fade duration in frames. It is truncated to the audio length.
+    :param window_fn: The window function
+    :return: The faded audio
+    """
+    duration = min(duration, audio.shape[-1])
+    audio = audio.copy()
+    if duration > 0:
+        audio[..., -duration:] *= get_window(window_fn, duration * 2)[duration:]
+    return audio
+
+
+# The shared window bank used by the grain tools
+WINDOW_BANK = WindowBank()
+
+
+def get_window(window_fn, length: int, dtype=np.float64) -> np.ndarray:
+    """
+    Gets a cached, read-only window from the shared window bank
+    :param window_fn: The window function (for example np.hanning)
+    :param length: The window length
+    :param dtype: The window dtype
+    :return: A read-only window array
+    """
+    return WINDOW_BANK(window_fn, length, dtype)
@@ -0,0 +1,36 @@
+"""
+File: index_table.py
+
+Creates the indexes for the category queries in query.py, updates the query planner statistics,
+and reports the query plan for each category so you can confirm that the indexes are used.
+"""
+
+import os
+import platform
+import sqlite3
+import query
+from grain import index_advisor
+
+MAC = "/Users/jmartin50/recording"
+ARGON = "/Users/jmartin50/recording"
+PC = "D:\\recording"
+SYSTEM = platform.system()
+
+if SYSTEM == "Darwin":
+    DB = os.path.join(MAC, "data/grains.sqlite3")
+elif SYSTEM == "Linux":
+    DB = os.path.join(ARGON, "data/grains.sqlite3")
+else:
+    DB = os.path.join(PC, "data/grains.sqlite3")
+
+GRAIN_LENGTH = 8192
+QUERIES = query.QUERY1 + query.QUERY2 + query.QUERY3 + query.QUERY4
+
+db = sqlite3.connect(DB)
+cursor = db.cursor()
+
+index_advisor.create_indexes(db, cursor, index_advisor.recommend_indexes(QUERIES))
+index_advisor.report(cursor, GRAIN_LENGTH, QUERIES)
+
+db.close()
+print("Done.")
@@ -0,0 +1,41 @@
+"""
+File: migrate_files_table.py
+
+Migrates a grain database from per-grain file paths to the files table. Each source file path is
+stored once, grains refer to it by grains.file_id, and the sample rate, length and modification
+time of each file are read from the audio corpus. The script can be rerun safely.
+"""
+
+import os
+import platform
+import grain.grain_sql as grain_sql
+
+MAC = "/Users/jmartin50/recording"
+ARGON = "/Users/jmartin50/recording"
+PC = "D:\\recording"
+SYSTEM = platform.system()
+
+if SYSTEM == "Darwin":
+    DB = os.path.join(MAC, "data/grains.sqlite3")
+    SOURCE_DIRS = os.path.join(MAC, "samples/granulation_chunks")
+elif SYSTEM == "Linux":
+    DB = os.path.join(ARGON, "data/grains.sqlite3")
+    SOURCE_DIRS = [os.path.join(ARGON, "samples/granulation_chunks"), os.path.join("/old_Users/jmartin50/recording", "samples/granulation_chunks")]
+else:
+    DB = os.path.join(PC, "data/grains.sqlite3")
+    SOURCE_DIRS = os.path.join(PC, "samples\\granulation_chunks")
+
+# Dropping the grains.file column needs SQLite 3.35 or later. VACUUM reclaims the space afterward.
+DROP_FILE_COLUMN = True
+VACUUM = True
+
+if __name__ == "__main__":
+    db, cursor = grain_sql.connect_to_db(DB)
+    print("Migrating...")
+    grain_sql.migrate_files_table(db, cursor, DROP_FILE_COLUMN)
+    grain_sql.update_file_info(db, cursor, SOURCE_DIRS)
+    if VACUUM:
+        print("Vacuuming...")
+        cursor.execute("VACUUM;")
+    db.close()
+    print("Done.")
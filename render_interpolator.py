@@ -12,10 +12,18 @@ import random
 import scipy.signal as signal
 from grain.effects import *
 import grain.grain_assembler as grain_assembler
+import grain.windows as windows
+from grain.decode_cache import DecodeCache
+from grain.source_index import SourceIndex
+from grain.grain_store import GrainStore
+from grain.grain_rtree import FeatureRTree
+from grain.grain_pool import SharedGrainPool
+from grain.grain_table import GrainTable
 import os
 import platform
 import query
-import multiprocessing as mp
+import grain.scheduler as scheduler
+import grain.streaming as streaming
 from datetime import datetime
 
 
@@ -30,44 +38,61 @@ if SYSTEM == "Darwin":
     SOURCE_DIRS = os.path.join(MAC, "samples/granulation_chunks")
     OUT = os.path.join(MAC, "out")
     DB = os.path.join(MAC, "data/grains.sqlite3")
+    STORE = os.path.join(MAC, "data/grains")
+    CACHE_DIR = os.path.join(MAC, "cache/decoded")
     
 elif SYSTEM == "Linux":
     SOURCE_DIRS = [os.path.join(ARGON, "samples/granulation_chunks"), os.path.join("/old_Users/jmartin50/recording", "samples/granulation_chunks")]
     OUT = os.path.join(ARGON, "out")
     DB = os.path.join(ARGON, "data/grains.sqlite3")
+    STORE = os.path.join(ARGON, "data/grains")
+    CACHE_DIR = os.path.join(ARGON, "cache/decoded")
 
 else:
     SOURCE_DIRS = os.path.join(PC, "samples\\granulation_chunks")
     OUT = os.path.join(PC, "out")
     DB = os.path.join(PC, "data/grains.sqlite3")
+    STORE = os.path.join(PC, "data/grains")
+    CACHE_DIR = os.path.join(PC, "cache\\decoded")
 
 
-def render(grain_entry_categories, num_unique_grains_per_section, num_repetitions, grain_overlap_num, num_channels, source_dirs, out_dir, name):
+def render(grain_entry_categories, num_unique_grains_per_section, num_repetitions, grain_overlap_num, num_channels, source_dirs, out_dir, name, seed=None, block_size=None, dtype=np.float64):
     """
     Renders an audio file
-    :param grain_entry_categories: A list of grain record lists
+    :param grain_entry_categories: A list of grain record lists, a list of GrainTables, or a SharedGrainPool
     :param num_unique: The number of unique grains to use for each category
     :param num_channels: The number of channels in the output audio file
     :param source_dirs: The location(s) of the audio files
     :param out_dir: The output directory
     :param name: The output file name
+    :param seed: The random seed. If None, the render is seeded from the system.
+    :param block_size: If provided, the audio is merged and written in blocks of this many frames,
+    so memory does not grow with the length of the render
+    :param dtype: The dtype of the merge buffer and of the audio between post-chain steps. np.float32 halves their memory.
     """
     DB = -6
     rng = random.Random()
-    rng.seed()
+    rng.seed(seed)
     
     # Assemble the unique grain lists. There will be N lists, one for each SELECT statement.
     grain_source_lists = []
     for j, entry_category in enumerate(grain_entry_categories):
-        grain_list = []
-        # select NUM unique grains
-        for _ in range(num_unique_grains_per_section):
-            idx = rng.randrange(0, len(entry_category))
-            if "church-bell" not in entry_category[idx]["file"]:
-                grain = entry_category[idx]
-                grain["distance_between_grains"] = grain_overlap_num
-                grain["channel"] = 0
-                grain_list.append(grain)
+        if type(entry_category) == list:
+            grain_list = []
+            # select NUM unique grains
+            for _ in range(num_unique_grains_per_section):
+                idx = rng.randrange(0, len(entry_category))
+                if "church-bell" not in entry_category[idx]["file"]:
+                    grain = entry_category[idx]
+                    grain["distance_between_grains"] = grain_overlap_num
+                    grain["channel"] = 0
+                    grain_list.append(grain)
+        else:
+            # select NUM unique grains, with the same rng calls as for a list
+            grain_list = entry_category.take([rng.randrange(0, len(entry_category)) for _ in range(num_unique_grains_per_section)])
+            grain_list = grain_list[np.array(["church-bell" not in file for file in grain_list["file"]], dtype=bool)]
+            grain_list["distance_between_grains"] = grain_overlap_num
+            grain_list["channel"] = 0
         # print(f"{len(grain_list)} grains added to the list")
         grain_source_lists.append(grain_list)
     
@@ -76,6 +101,10 @@ def render(grain_entry_categories, num_unique_grains_per_section, num_repetition
     SKIP = 3
     for i in range(len(grain_source_lists)):
         idxs = [rng.randrange(0, len(grain_source_lists[i])) for _ in range(NUM)]
+        if isinstance(grain_source_lists[i], GrainTable):
+            target = (i+SKIP) % len(grain_source_lists)
+            grain_source_lists[target] = GrainTable.concatenate([grain_source_lists[target], grain_source_lists[i].take(idxs)])
+            continue
         for idx in idxs:
             grain_source_lists[(i+SKIP) % len(grain_source_lists)].append(grain_source_lists[i][idx])
     
@@ -92,8 +121,9 @@ def render(grain_entry_categories, num_unique_grains_per_section, num_repetition
     grains = assembled_grains_lists[0]
     for i in range(1, len(assembled_grains_lists)):
         overlap_num = int(min(len(grains), len(assembled_grains_lists[i])) * 0.95)
-        grains = grains[:-overlap_num] + grain_assembler.interpolate(grains[-overlap_num:],
-                                              assembled_grains_lists[i][:overlap_num]) + assembled_grains_lists[i][overlap_num:]
+        chunks = [grains[:-overlap_num], grain_assembler.interpolate(grains[-overlap_num:], assembled_grains_lists[i][:overlap_num]),
+                  assembled_grains_lists[i][overlap_num:]]
+        grains = GrainTable.concatenate(chunks) if isinstance(grains, GrainTable) else chunks[0] + chunks[1] + chunks[2]
     grain_distances = grain_assembler.NthPowerEnvelope([grain_overlap_num, grain_overlap_num, int(grain_overlap_num * 0.35), 
                                                       grain_overlap_num, grain_overlap_num, int(grain_overlap_num * 0.35), grain_overlap_num, grain_overlap_num], 
                                                      [0, 5000, 5200, 5400, 
@@ -102,33 +132,46 @@ def render(grain_entry_categories, num_unique_grains_per_section, num_repetition
 
     grain_assembler.swap_random_pair(grains, 0.2, rng)
     grain_assembler.spread_across_channels(grains, num_channels)
-    # for i in range(len(grains)):
-    #     grains[i]["distance_between_grains"] = grain_distances(i)
+    # for grain, distance in zip(grains, grain_distances(np.arange(len(grains))).tolist()):
+    #     grain["distance_between_grains"] = distance
     grain_assembler.randomize_param(grains, "distance_between_grains", rng, 50)
     grain_assembler.calculate_grain_positions(grains)
-    grain_sql.read_grains_from_file(grains, source_dirs)
-    for i in range(len(grains)):
-        # print(f"Grain {i} length: {grains[i]['grain'].size}, source: {grains[i]['file']}, frames: {grains[i]['start_frame']}:{grains[i]['end_frame']}")
-        grains[i]["grain"] = operations.adjust_level(grains[i]["grain"], DB)
-        
-    grain_audio = grain_assembler.merge(grains, num_channels, np.hanning)
-    grain_audio = operations.force_equal_energy(grain_audio, -3, 22000)
+    # Grains from a SharedGrainPool are already loaded
+    if type(grains) == list or np.any(grains["sample_offset"] < 0):
+        source_index = SourceIndex(source_dirs, os.path.join(CACHE_DIR, "source_index.json"))
+        grain_sql.read_grains_from_file(grains, source_index, DecodeCache(CACHE_DIR), grain_store=GrainStore(STORE))
+    # Adjust the level of each grain. Table grains are views of a shared sample buffer,
+    # so the adjusted audio goes into a new buffer.
+    grain_assembler.adjust_grain_levels(grains, DB)
 
     # Apply final effects to the assembled audio
     lpf = signal.butter(2, 500, btype="lowpass", output="sos", fs=44100)
     hpf = signal.butter(8, 100, btype="highpass", output="sos", fs=44100)
-    grain_audio = signal.sosfilt(lpf, grain_audio)
-    grain_audio = signal.sosfilt(hpf, grain_audio)
-    grain_audio = operations.fade_in(grain_audio, "hanning", 22050)
-    grain_audio = operations.fade_out(grain_audio, "hanning", 22050)
+    path = os.path.join(out_dir, name)
+
+    if block_size is not None:
+        num_frames = int(np.max(grains["end_idx"])) if isinstance(grains, GrainTable) else max(grain["end_idx"] for grain in grains)
+        print(f"Writing file {path} with {num_frames + 44100 * 2} samples")
+        blocks = grain_assembler.merge_blocks(grains, num_channels, np.hanning, block_size, dtype=dtype)
+        streaming.render_blocks(blocks, num_frames, num_channels, path, 44100, 24, -3, 22000, [lpf, hpf], 22050, np.hanning,
+                                44100 * 2, block_size, CACHE_DIR, dtype=dtype)
+        return
+
+    grain_audio = grain_assembler.merge(grains, num_channels, np.hanning, dtype)
+    # force_equal_energy always returns float64
+    grain_audio = operations.force_equal_energy(grain_audio, -3, 22000).astype(dtype, copy=False)
+    # The filters run in float64, since the 8th-order highpass loses precision in float32
+    grain_audio = signal.sosfilt(lpf, grain_audio).astype(dtype, copy=False)
+    grain_audio = signal.sosfilt(hpf, grain_audio).astype(dtype, copy=False)
+    grain_audio = windows.fade_in(grain_audio, 22050, np.hanning)
+    grain_audio = windows.fade_out(grain_audio, 22050, np.hanning)
     grain_audio = operations.adjust_level(grain_audio, -12)
     # add silence at the end
-    grain_audio = np.hstack((grain_audio, np.zeros((num_channels, 44100 * 2))))
+    grain_audio = np.hstack((grain_audio, np.zeros((num_channels, 44100 * 2), dtype=dtype)))
 
     # Write the audio
     audio = audiofile.AudioFile(sample_rate=44100, bits_per_sample=24, num_channels=num_channels)
     audio.samples = grain_audio
-    path = os.path.join(out_dir, name)
     print(f"Writing file {path} with {audio.samples.shape[-1]} samples")
     audiofile.write_with_pedalboard(audio, os.path.join(out_dir, name))
     # print("Done.")
@@ -140,7 +183,7 @@ if __name__ == "__main__":
     # Retrieve grain metadata and grains
     print("Retrieving grains...")
     db, cursor = grain_sql.connect_to_db(DB)
-    grain_entry_categories = query.query4(GRAIN_LENGTH, cursor)
+    grain_entry_categories = query.query4(GRAIN_LENGTH, cursor, FeatureRTree.from_db(cursor, require_current=True), as_table=True)
     db.close()
 
     # Generate candidate audio
@@ -149,16 +192,14 @@ if __name__ == "__main__":
     NUM_AUDIO_CANDIDATES = 5
     NUM_CHANNELS = 8
     NUM_UNIQUE_GRAINS = 10
-    if NUM_AUDIO_CANDIDATES > 1:
-        processes = [mp.Process(target=render, args=(grain_entry_categories, NUM_UNIQUE_GRAINS, 
-                                                     [200, 100, 150, 200, 300, 150, 50, 100, 300, 300, 200, 100, 200, 80, 250, 300, 150, 300, 150, 100, 50, 40, 100, 20, 20, 20, 20, 20, 100, 200], 
-                                                     -GRAIN_LENGTH + 75, NUM_CHANNELS, SOURCE_DIRS, OUT, f"out_{i+1}.wav")) for i in range(NUM_AUDIO_CANDIDATES)]
-        for p in processes:
-            p.start()
-        for p in processes:
-            p.join()
-    else:
-        render(grain_entry_categories, NUM_UNIQUE_GRAINS, 200, -GRAIN_LENGTH + 75, NUM_CHANNELS, SOURCE_DIRS, OUT, "out_1.wav")    
+    # Load the grains once into shared memory, so the workers do not copy the categories or decode the sources again
+    source_index = SourceIndex(SOURCE_DIRS, os.path.join(CACHE_DIR, "source_index.json"))
+    pool = SharedGrainPool(grain_entry_categories, source_index, DecodeCache(CACHE_DIR), GrainStore(STORE), os.cpu_count())
+    jobs = [scheduler.RenderJob("query4", [200, 100, 150, 200, 300, 150, 50, 100, 300, 300, 200, 100, 200, 80, 250, 300, 150, 300, 150, 100, 50, 40, 100, 20, 20, 20, 20, 20, 100, 200],
+                                -GRAIN_LENGTH + 75, NUM_CHANNELS, f"out_{i+1}.wav", num_unique_grains=NUM_UNIQUE_GRAINS) for i in range(NUM_AUDIO_CANDIDATES)]
+    scheduler.run_jobs(render, jobs, {"query4": pool}, SOURCE_DIRS, OUT)
+    pool.close()
+    pool.unlink()
     duration = datetime.now() - start
     print("Elapsed time: {}:{:0>2}".format(duration.seconds // 60, duration.seconds % 60))
     
\ No newline at end of file
@@ -0,0 +1,36 @@
+"""
+File: rtree_table.py
+
+Builds or refreshes the R*Tree index over the grain feature space.
+Refreshing adds new grains and removes deleted grains. Set REBUILD to True after changing
+feature values in place or changing the mirrored fields.
+"""
+
+import os
+import platform
+import grain.grain_sql as grain_sql
+from grain.grain_rtree import FeatureRTree
+
+MAC = "/Users/jmartin50/recording"
+ARGON = "/Users/jmartin50/recording"
+PC = "D:\\recording"
+SYSTEM = platform.system()
+
+if SYSTEM == "Darwin":
+    DB = os.path.join(MAC, "data/grains.sqlite3")
+elif SYSTEM == "Linux":
+    DB = os.path.join(ARGON, "data/grains.sqlite3")
+else:
+    DB = os.path.join(PC, "data/grains.sqlite3")
+
+REBUILD = False
+
+if __name__ == "__main__":
+    db, cursor = grain_sql.connect_to_db(DB)
+    rtree = FeatureRTree.from_db(cursor)
+    if rtree is None or REBUILD:
+        FeatureRTree().build(db, cursor)
+    else:
+        rtree.refresh(db, cursor)
+    db.close()
+    print("Done.")
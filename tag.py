@@ -1,12 +1,14 @@
 """
 File: tag.py
 
-This is a grain tagger.
+This is a grain tagger. Only grains added since the last run are tagged; set REBUILD to True
+to tag every grain again after changing the keywords.
 """
 
 import os
 import platform
 import sqlite3
+from grain.grain_tags import tag_grains
 
 MAC = "/Users/jmartin50/recording"
 ARGON = "/Users/jmartin50/recording"
@@ -20,8 +22,7 @@ elif SYSTEM == "Linux":
 else:
     DB = os.path.join(PC, "data/grains.sqlite3")
 
-db = sqlite3.connect(DB)
-cursor = db.cursor()
+REBUILD = False
 
 # If a file path contains the following keyword, the associated list of tags applies to that grain.
 tags = {
@@ -66,19 +67,10 @@ tags = {
     "fdr": ["fdr"],
 }
 
-print("Tagging...")
-for key, val in tags.items():
-    cursor.execute("SELECT id FROM grains WHERE LOWER(file) LIKE ?;", (f"%{key}%",))
-    items = cursor.fetchall()
-    for tag in val:
-        for grain in items:
-            cursor.execute("INSERT INTO tags (grain_id, tag) VALUES (?, ?);", (grain[0], tag))
-db.commit()
-
-# clean up duplicate tags
-print("Cleaning up duplicate tags...")
-cursor.execute("DELETE FROM tags WHERE rowid NOT IN (SELECT MIN(rowid) FROM tags GROUP BY grain_id, tag);")
-db.commit()
-
-db.close()
-print("Done.")
+if __name__ == "__main__":
+    db = sqlite3.connect(DB)
+    cursor = db.cursor()
+    print("Tagging...")
+    tag_grains(db, cursor, tags, REBUILD)
+    db.close()
+    print("Done.")
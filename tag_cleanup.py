@@ -1,7 +1,8 @@
 """
 File: tag_cleanup.py
 
-This script cleans up duplicate grain tags.
+This script cleans up duplicate grain tags. It is only needed for databases tagged before the
+UNIQUE (grain_id, tag) index existed; tag.py now removes the duplicates once when it creates the index.
 """
 
 import os
@@ -31,6 +31,8 @@ cursor.execute("""
         FOREIGN KEY (grain_id) REFERENCES grains(id)
     );
 """)
+cursor.execute("CREATE INDEX idx_tags_tag_grain_id ON tags (tag, grain_id);")
+cursor.execute("CREATE UNIQUE INDEX idx_tags_grain_id_tag ON tags (grain_id, tag);")
 
 db.commit()
 db.close()
@@ -0,0 +1,42 @@
+"""
+File: test_buffer_dtype.py
+
+Description: Checks that the float32 merge and post-chain buffers match float64 to within one 24-bit step.
+"""
+
+import aus.operations as operations
+import numpy as np
+import scipy.signal as signal
+from grain import grain_assembler, windows
+
+LSB = 1 / 2 ** 23
+
+
+def test_float32_buffers_match_float64():
+    rng = np.random.default_rng(5)
+    grains = []
+    for i in range(200):
+        frequency = rng.uniform(100, 2000)
+        audio = np.sin(2 * np.pi * frequency * np.arange(2048) / 44100) + rng.normal(0, 0.1, 2048)
+        grains.append({"grain": (audio * rng.uniform(0.05, 1.0)).astype(np.float32), "start_frame": 0, "end_frame": 2048,
+                       "distance_between_grains": -1500, "channel": i % 2})
+    grain_assembler.calculate_grain_positions(grains)
+    filters = [signal.butter(2, 500, btype="lowpass", output="sos", fs=44100), signal.butter(8, 100, btype="highpass", output="sos", fs=44100)]
+
+    buffers = {}
+    for dtype in (np.float64, np.float32):
+        audio = grain_assembler.merge(grains, 2, np.hanning, dtype)
+        assert audio.dtype == dtype
+        buffers[dtype] = [audio]
+        audio = operations.force_equal_energy(audio, -3, 22000).astype(dtype, copy=False)
+        for sos in filters:
+            audio = signal.sosfilt(sos, audio).astype(dtype, copy=False)
+        audio = windows.fade_out(windows.fade_in(audio, 22050, np.hanning), 22050, np.hanning)
+        assert audio.dtype == dtype
+        buffers[dtype].append(audio)
+
+    for reference, audio in zip(buffers[np.float64], buffers[np.float32]):
+        peak = np.max(np.abs(reference))
+        assert peak > 0.1
+        # The merge buffer can exceed full scale before leveling, so the step is scaled with it
+        assert np.max(np.abs(audio.astype(np.float64) - reference)) <= LSB * max(peak, 1.0)
@@ -0,0 +1,40 @@
+"""
+File: test_grain_tags.py
+
+Description: Checks that grains reloaded after an interrupted analysis are tagged, even when
+they reuse the ids of the deleted grains.
+"""
+
+import numpy as np
+import pedalboard as pb
+import sqlite3
+from grain import analysis, grain_tags
+
+
+def test_tags_grains_reloaded_after_interrupted_load(tmp_path):
+    source_dir = tmp_path / "audio"
+    source_dir.mkdir()
+    for name, frequency in [("bell_1.wav", 440), ("drum_2.wav", 110)]:
+        audio = 0.5 * np.sin(2 * np.pi * frequency * np.arange(44100) / 44100)
+        with pb.io.AudioFile(str(source_dir / name), "w", 44100, 1) as outfile:
+            outfile.write(audio[np.newaxis, :].astype(np.float32))
+
+    db = sqlite3.connect(str(tmp_path / "grains.sqlite3"))
+    cursor = db.cursor()
+    cursor.execute("CREATE TABLE tags (id INTEGER PRIMARY KEY, grain_id INTEGER NOT NULL, tag TEXT NOT NULL);")
+    keywords = {"bell": ["bell"], "drum": ["drum"]}
+    analysis.analyze_corpus(db, cursor, str(source_dir), [2048], max_workers=1)
+    grain_tags.tag_grains(db, cursor, keywords)
+
+    # Mark the load of the file with the last grains as interrupted, so it is deleted and analyzed again
+    cursor.execute("SELECT file_id FROM grains ORDER BY id DESC LIMIT 1;")
+    cursor.execute("DELETE FROM analyzed_files WHERE file_id = ?;", cursor.fetchone())
+    db.commit()
+    analysis.analyze_corpus(db, cursor, str(source_dir), [2048], max_workers=1)
+    assert grain_tags.tag_grains(db, cursor, keywords) > 0
+
+    cursor.execute("SELECT COUNT(*) FROM grains WHERE id NOT IN (SELECT grain_id FROM tags);")
+    assert cursor.fetchone()[0] == 0
+    cursor.execute("SELECT COUNT(*) FROM tags WHERE grain_id NOT IN (SELECT id FROM grains);")
+    assert cursor.fetchone()[0] == 0
+    db.close()